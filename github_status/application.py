@@ -5,11 +5,13 @@ import locale
 import os
 
 from flask import Flask
+from sqlalchemy.orm import configure_mappers
 from yaml import safe_load
 
 import github_status as app_root
 from github_status.blueprints import all_blueprints
-from github_status.extensions import db
+from github_status.compression import GzipMiddleware
+from github_status.extensions import api_workers, db, github, page_cache, page_workers, static_files, workers
 
 APP_ROOT_FOLDER = os.path.abspath(os.path.dirname(app_root.__file__))
 TEMPLATE_FOLDER = os.path.join(APP_ROOT_FOLDER, 'templates')
@@ -84,12 +86,34 @@ def create_app(config_obj):
         app.register_blueprint(bp)
 
     # Initialize extensions/add-ons/plugins.
+    api_workers.init_app(app)
     db.init_app(app)
+    github.init_app(app)
+    page_cache.init_app(app)
+    page_workers.init_app(app)
+    static_files.init_app(app)
+    workers.init_app(app)
 
     # Activate middleware.
     locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')  # For filters inside the middleware file.
     with app.app_context():
         import_module('github_status.middleware')
+    app.wsgi_app = GzipMiddleware(app.wsgi_app, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_MIME_TYPES'],
+                                  app.config['COMPRESS_LEVEL'])
 
     # Return the application instance.
     return app
+
+
+def warm_up(app):
+    """Loads everything that's otherwise loaded lazily on the first requests. Call before forking, so all processes
+    share these memory pages copy-on-write instead of each building its own copy.
+
+    Positional arguments:
+    app -- the Flask application returned by create_app().
+    """
+    with app.app_context():
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)  # Compiled and cached by Jinja.
+        configure_mappers()
+        app.url_map.update()  # Sorts rules, done by the first request otherwise.
@@ -0,0 +1,71 @@
+"""Native Tornado request handlers for the GitHub-facing API routes, used by prodserver.
+
+Everything else runs in Flask through Tornado's WSGIContainer, which serves each request synchronously inside the
+IOLoop: one slow GitHub API call stalls every other request of that process. These handlers run the same validation and
+persistence code as the Flask views in the api_workers thread pool instead, and wait for it without blocking the IOLoop.
+"""
+
+import json
+import sys
+import time
+
+from tornado import gen, web
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from github_status.extensions import api_workers, db, READ_PRIMARY_COOKIE
+from github_status.views.api.query_github import run_query
+
+
+def run_in_pool(app, pool, func, *args):
+    """Runs a function in a Workers pool within the Flask application context, without blocking the IOLoop.
+
+    Positional arguments:
+    app -- Flask application instance.
+    pool -- Workers instance to run the function in.
+    func -- the function to call. Remaining arguments are passed to it.
+
+    Returns:
+    tornado.concurrent.Future resolved in the current IOLoop with the function's return value or exception.
+    """
+    future = Future()
+    io_loop = IOLoop.current()
+
+    def run():
+        try:
+            result = func(*args)
+        except Exception:
+            io_loop.add_callback(future.set_exc_info, sys.exc_info())
+        else:
+            io_loop.add_callback(future.set_result, result)
+    with app.app_context():
+        pool.submit(run)
+    return future
+
+
+class QueryHandler(web.RequestHandler):
+    """Tornado version of the /api/query_github and /api/query_github/update Flask views.
+
+    Keyword arguments (passed through the Tornado URL spec):
+    app -- Flask application instance.
+    add_repo -- checks for repo_url collisions if True, otherwise checks for invalid repo_urls if False.
+    """
+
+    def initialize(self, app, add_repo):
+        self.app = app
+        self.add_repo = add_repo
+
+    @gen.coroutine
+    def post(self):
+        repo_url = self.get_body_argument('repo_url', None)
+        if not repo_url:
+            raise web.HTTPError(400)
+        result = yield run_in_pool(self.app, api_workers, run_query, repo_url, self.add_repo)
+
+        # Same as Database.set_read_primary_cookie(), successful queries always write to the database.
+        if result['success'] and db.replica_binds:
+            self.set_cookie(READ_PRIMARY_COOKIE, repr(time.time() + db.read_your_writes),
+                            expires_days=db.read_your_writes / 86400.0)
+
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(result, indent=2))
@@ -0,0 +1,242 @@
+"""Pluggable key/value cache backends with a bounded size and least-recently-used eviction.
+
+With lru=False, reads don't update recency (for SQLite and files, they don't write) and entries are evicted by their
+last write instead.
+
+All backends share the same interface (get(), set(), delete(), clear()) and store any picklable value. Use
+create_cache() to instantiate one from configuration values.
+
+memory -- in-process only. Fastest, but every Tornado child has its own copy.
+sqlite -- a table in a local SQLite database file, shared by all processes on the host.
+file -- one file per key in a local directory, shared by all processes on the host.
+
+Values are unpickled when read, so the sqlite and file backends only accept paths other users can't write to.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import cPickle as pickle
+import hashlib
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+
+class MemoryCache(object):
+    """In-process LRU cache.
+
+    Positional arguments:
+    max_entries -- evict the least recently used entries beyond this many.
+
+    Keyword arguments:
+    lru -- move entries to the end on get(). If False, the least recently written entries are evicted instead.
+    """
+
+    def __init__(self, max_entries, lru=True):
+        self.max_entries = max_entries
+        self.lru = lru
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            value = self._data[key]
+            if self.lru:
+                self._data[key] = self._data.pop(key)  # Move to the end, most recently used.
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)  # Callers may mutate their copy afterwards.
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache(object):
+    """LRU cache stored in a SQLite database table. A new connection is used for every operation, so it's fork-safe.
+
+    Positional arguments:
+    path -- file path to the SQLite database. Created if it doesn't exist.
+    max_entries -- evict the least recently used entries beyond this many.
+
+    Keyword arguments:
+    lru -- update the access time on get(), a write. If False, get() only reads and the oldest writes are evicted.
+    """
+
+    def __init__(self, path, max_entries, lru=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.lru = lru
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        """Yields a new connection, commits on success and always closes it."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                return None
+            if self.lru:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+        return pickle.loads(str(row[0]))
+
+    def set(self, key, value):
+        value = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, value, time.time()))
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 '
+                         'OFFSET ?)', (self.max_entries, ))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key, ))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache')
+
+
+class FileCache(object):
+    """LRU cache stored as one pickle file per key in a directory. File modification times track recent use.
+
+    Positional arguments:
+    directory -- directory to store files in. Created if it doesn't exist.
+    max_entries -- evict the least recently used entries beyond this many.
+
+    Keyword arguments:
+    lru -- touch files on get(). If False, the least recently written entries are evicted instead.
+    """
+
+    def __init__(self, directory, max_entries, lru=True):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.lru = lru
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            if self.lru:
+                os.utime(path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        temp_path = '{}.{}.{}'.format(path, os.getpid(), threading.current_thread().ident)
+        with open(temp_path, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)  # Atomic, other processes never read partial files.
+
+        # Evict.
+        paths = [os.path.join(self.directory, p) for p in os.listdir(self.directory) if p.endswith('.cache')]
+        if len(paths) > self.max_entries:
+            for stale in sorted(paths, key=self._mtime)[:len(paths) - self.max_entries]:
+                self._remove(stale)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for p in os.listdir(self.directory):
+            if p.endswith('.cache'):
+                self._remove(os.path.join(self.directory, p))
+
+
+def check_private(path):
+    """Makes sure only the current user can write to a cache path, or create it. Unpickling data written by another
+    user would let them run code in this application.
+
+    Positional arguments:
+    path -- file path (sqlite) or directory (file) of a cache backend. Doesn't have to exist yet, its parent does.
+
+    Raises:
+    ValueError -- raised if path is empty, or if it or its parent is owned by another user or writable by group/others.
+    """
+    if not path:
+        raise ValueError('Cache path required, in a directory owned by the application.')
+    path = os.path.abspath(path)
+    for checked in (path, os.path.dirname(path)):
+        try:
+            status = os.stat(checked)
+        except OSError:
+            if checked == path:
+                continue  # Created by the backend.
+            raise ValueError('Cache directory not found: {}'.format(checked))
+        if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise ValueError('Cache path writable by other users: {}'.format(checked))
+
+
+def create_cache(backend, path, max_entries, lru=True):
+    """Instantiates a cache backend.
+
+    Raises:
+    ValueError -- raised on unknown backends, or if check_private() rejects the path of the sqlite or file backend.
+
+    Positional arguments:
+    backend -- name of the backend: 'memory', 'sqlite', 'file', or None to disable caching.
+    path -- file path (sqlite) or directory (file) to store entries in. Ignored by the memory backend.
+    max_entries -- evict the least recently used entries beyond this many.
+
+    Keyword arguments:
+    lru -- passed to the backend, False for reads which never write.
+
+    Returns:
+    Cache instance, or None if backend is None.
+    """
+    if backend is None:
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_entries, lru)
+    if backend in ('sqlite', 'file'):
+        check_private(path)
+    if backend == 'sqlite':
+        return SQLiteCache(path, max_entries, lru)
+    if backend == 'file':
+        return FileCache(path, max_entries, lru)
+    raise ValueError('Unknown cache backend: {}'.format(backend))
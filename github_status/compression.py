@@ -0,0 +1,123 @@
+"""WSGI middleware gzipping dynamic responses (rendered pages, JSON) for clients accepting it.
+
+Static files are precompressed by `manage.py build_static` instead (see github_status.static_assets).
+"""
+
+import re
+import zlib
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # zlib writes a gzip header and trailer instead of a zlib one.
+
+
+def accepts_gzip(accept_encoding):
+    """Tells whether a client accepts gzip-encoded responses.
+
+    Positional arguments:
+    accept_encoding -- value of the request's Accept-Encoding header (e.g. 'gzip, deflate' or 'gzip;q=0, *').
+
+    Returns:
+    True if gzip, or * without gzip, is listed with a non-zero quality.
+    """
+    qualities = dict()
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.partition(';')
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        try:
+            qualities[coding.strip()] = float(match.group(1)) if match else 1.0
+        except ValueError:
+            qualities[coding.strip()] = 0.0
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+class GzipMiddleware(object):
+    """Compresses responses of a WSGI application on the fly, chunk by chunk as the application yields them.
+
+    Only responses with one of the given content types and at least minimum_size bytes long are compressed. Responses
+    without a Content-Length header (streamed) are compressed regardless of their size. Vary: Accept-Encoding is added
+    to all responses of these content types, compressed or not, so caches don't serve one client's variant to another.
+
+    Positional arguments:
+    application -- WSGI application to wrap (e.g. the Flask application's wsgi_app).
+    minimum_size -- smaller responses are sent as they are, compressing them isn't worth it.
+    mime_types -- compressible content types, without parameters (e.g. text/html). Empty to disable compression.
+
+    Keyword arguments:
+    level -- gzip compression level, 1 (fastest) to 9 (smallest).
+    """
+
+    def __init__(self, application, minimum_size, mime_types, level=6):
+        self.application = application
+        self.minimum_size = minimum_size
+        self.mime_types = frozenset(mime_types)
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        accepted = accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        head = environ['REQUEST_METHOD'] == 'HEAD'  # No body to compress, headers must match the GET response.
+        weak_validator = 'W/' in environ.get('HTTP_IF_NONE_MATCH', '').upper()
+        state = dict()  # start_response() may be called lazily, on the first iteration of the application's iterable.
+
+        def wrapped_start_response(status, headers, exc_info=None):
+            headers, compress = self._headers(status, headers, accepted and not head)
+            if status.startswith('304') and accepted and weak_validator:
+                headers = self._weaken_etag(headers)  # Client revalidated the gzipped variant.
+            write = start_response(status, headers, exc_info)
+            state['compressor'] = zlib.compressobj(self.level, zlib.DEFLATED, GZIP_WBITS) if compress else None
+            if not compress:
+                return write
+            return lambda data: write(state['compressor'].compress(data))  # Legacy write() callable.
+
+        app_iter = self.application(environ, wrapped_start_response)
+        if 'compressor' in state and state['compressor'] is None:
+            return app_iter  # Not compressing, pass the iterable through (e.g. file wrappers).
+        return self._compress(app_iter, state)
+
+    def _headers(self, status, headers, accepted):
+        """Decides whether to compress a response and returns its new headers.
+
+        Positional arguments:
+        status -- WSGI status string (e.g. '200 OK').
+        headers -- list of (name, value) tuples passed to start_response() by the application.
+        accepted -- the client accepts gzip and expects a body.
+
+        Returns:
+        Tuple of the list of headers to send, and True if the body must be compressed.
+        """
+        values = dict((k.lower(), v) for k, v in headers)
+        if values.get('content-type', '').split(';')[0].strip().lower() not in self.mime_types:
+            return headers, False
+
+        vary = [v.strip() for v in values.get('vary', '').split(',') if v.strip()]
+        if '*' not in vary and 'accept-encoding' not in [v.lower() for v in vary]:
+            vary.append('Accept-Encoding')
+        headers = [(k, v) for k, v in headers if k.lower() != 'vary'] + [('Vary', ', '.join(vary))]
+
+        if not accepted or 'content-encoding' in values or 'no-transform' in values.get('cache-control', '').lower():
+            return headers, False
+        if int(status.split(None, 1)[0]) in (204, 206, 304):
+            return headers, False
+        if int(values.get('content-length', self.minimum_size)) < self.minimum_size:  # Streamed if no Content-Length.
+            return headers, False
+
+        headers = [(k, v) for k, v in headers if k.lower() != 'content-length'] + [('Content-Encoding', 'gzip')]
+        return self._weaken_etag(headers), True
+
+    @staticmethod
+    def _weaken_etag(headers):
+        """Marks the ETag weak, the compressed body isn't byte-for-byte equal to the one it was computed for."""
+        return [(k, v if k.lower() != 'etag' or v.upper().startswith('W/') else 'W/' + v) for k, v in headers]
+
+    @staticmethod
+    def _compress(app_iter, state):
+        """Yields the compressed body, closing the application's iterable when done (PEP 333)."""
+        try:
+            for chunk in app_iter:
+                if state['compressor'] is not None:
+                    chunk = state['compressor'].compress(chunk)
+                if chunk:
+                    yield chunk
+            if state.get('compressor') is not None:
+                yield state['compressor'].flush()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
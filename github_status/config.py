@@ -1,3 +1,4 @@
+import os
 from urllib import quote_plus
 
 
@@ -8,12 +9,46 @@ class HardCoded(object):
     here.
     """
     ADMINS = ['me@me.test']
-    DB_MODELS_IMPORTS = ('repositories',)
+    API_WORKERS_POOL_SIZE = 32  # Threads per process running async API requests of prodserver (async_handlers.py).
+    BULK_MAX_REPOS = 1000  # Max repo URLs in one /api/query_github/bulk request.
+    COMPRESS_LEVEL = 6  # Gzip level of dynamic responses, 1 (fastest) to 9 (smallest).
+    COMPRESS_MIME_TYPES = ['application/javascript', 'application/json', 'text/css', 'text/html', 'text/plain']
+    COMPRESS_MIN_SIZE = 500  # Bytes, smaller responses aren't gzipped. Empty COMPRESS_MIME_TYPES to disable gzip.
+    DB_MODELS_IMPORTS = ('jobs', 'repositories', 'versions')
+    DB_POOL_PRE_PING = True  # Test MySQL connections with SELECT 1 before use, replacing ones the server closed.
+    DB_READ_YOUR_WRITES = 5  # Seconds after a client's write during which its reads go to the primary, not replicas.
+    DB_REPLICA_URIS = list()  # Read replica database URIs. SELECTs of GET requests are spread across them.
     ENVIRONMENT = property(lambda self: self.__class__.__name__)
+    GITHUB_CACHE_BACKEND = 'memory'  # Cache for GitHub responses: 'memory', 'sqlite', 'file', or None to disable.
+    GITHUB_CACHE_PATH = None  # SQLite database file or directory for the 'sqlite' and 'file' backends.
+    GITHUB_CACHE_SIZE = 1000  # Max cached responses, least recently used ones are evicted.
+    GITHUB_COMMITS_WINDOW = 50  # Number of most recent commits to look at for top committers. Over 100 paginates.
+    GITHUB_PAGE_WORKERS_POOL_SIZE = 8  # Threads per process prefetching pages of the commits API.
+    GITHUB_POOL_SIZE = 10  # Max keep-alive connections to api.github.com per process.
+    GITHUB_QUERY_TIMEOUT = 10  # Seconds to wait for all concurrent GitHub API calls of one request.
+    GITHUB_RATE_LIMIT_MAX_WAIT = 5  # Seconds to wait for the API quota to reset before giving up.
+    GITHUB_RETRIES = 2  # Retries on connection errors.
+    GITHUB_RETRY_BACKOFF = 0.2  # Seconds, doubles on every retry.
+    GITHUB_STATS_BACKOFF = 1  # Seconds before the first background retry of HTTP 202 responses, doubles every retry.
+    GITHUB_STATS_ORPHAN_DELAY = 60  # Seconds past its due time before another process resumes a pending job.
+    GITHUB_STATS_RETRIES = 8  # Background retries before giving up on GitHub generating repository statistics.
+    GITHUB_TIMEOUT = 5  # Seconds for each connect and read operation.
+    GITHUB_TOKENS = list()  # GitHub API tokens used round-robin. Empty list for anonymous API calls.
+    GITHUB_TOP_COMMITTERS = 3  # Number of top committers to track. Space separated logins must fit in 255 characters.
+    GRACEFUL_TIMEOUT = 30  # Seconds prodserver processes may take to finish in-flight requests when stopping.
+    PAGE_CACHE_BACKEND = None  # In-process page cache: 'memory' or None. Stale if others write without a shared one.
+    PAGE_CACHE_PATH = None  # For the shared backend, in a directory only the application's user can write to.
+    PAGE_CACHE_SHARED_BACKEND = None  # 'sqlite', 'file', or None. Needed to invalidate other processes' pages.
+    PAGE_CACHE_SIZE = 1000  # Max cached pages per backend, least recently used ones are evicted.
+    REPOS_INDEX_MAX_PAGE_LENGTH = 100  # Max rows per page of the repository listing.
+    SINGLE_FLIGHT_DB_LOCK = False  # Coalesce concurrent updates of the same repo across processes with MySQL locks.
+    STATIC_BUILD_FOLDER = os.path.join(os.path.dirname(__file__), 'static_build')  # Output of manage.py build_static.
     _SQLALCHEMY_DATABASE_DATABASE = 'github_status'
     _SQLALCHEMY_DATABASE_HOSTNAME = 'localhost'
     _SQLALCHEMY_DATABASE_PASSWORD = 'github_p@ssword'
     _SQLALCHEMY_DATABASE_USERNAME = 'github_service'
+    WORKERS_POOL_SIZE = 8  # Threads per process for concurrent I/O.
+    WSGI_QUEUE_SIZE = 64  # Flask requests waiting for a thread with prodserver --workers_threads, more get HTTP 503.
 
 
 class Config(HardCoded):
@@ -21,6 +56,10 @@ class Config(HardCoded):
     DEBUG = True
     TESTING = False
     SECRET_KEY = "i_don't_want_my_cookies_expiring_while_developing"
+    SQLALCHEMY_MAX_OVERFLOW = 10  # Connections opened beyond the pool size under load, closed when returned.
+    SQLALCHEMY_POOL_RECYCLE = 7200  # Seconds, reconnect before MySQL's wait_timeout closes idle connections.
+    SQLALCHEMY_POOL_SIZE = 10  # Connections kept per process. MySQL's max_connections must fit all plus overflow.
+    SQLALCHEMY_POOL_TIMEOUT = 10  # Seconds to wait for a free connection before raising an error.
     SQLALCHEMY_DATABASE_URI = property(lambda self: 'mysql://{u}:{p}@{h}/{d}'.format(
         d=quote_plus(self._SQLALCHEMY_DATABASE_DATABASE), h=quote_plus(self._SQLALCHEMY_DATABASE_HOSTNAME),
         p=quote_plus(self._SQLALCHEMY_DATABASE_PASSWORD), u=quote_plus(self._SQLALCHEMY_DATABASE_USERNAME)
@@ -30,6 +69,13 @@ class Config(HardCoded):
 class Testing(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test_database.sqlite'
+    SQLALCHEMY_MAX_OVERFLOW = None  # SQLite doesn't pool connections.
+    SQLALCHEMY_POOL_RECYCLE = None
+    SQLALCHEMY_POOL_SIZE = None
+    SQLALCHEMY_POOL_TIMEOUT = None
+    PAGE_CACHE_BACKEND = None  # Tests write to the database directly, without invalidating pages.
+    PAGE_CACHE_SHARED_BACKEND = None
+    STATIC_BUILD_FOLDER = None  # Serve the static folder as it is in the git repo.
 
 
 class Production(Config):
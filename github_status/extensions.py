@@ -4,27 +4,518 @@ To avoid circular imports with views and create_app(), extensions are instantiat
 (calling init_app()) in application.py.
 """
 
+from functools import wraps
 from logging import getLogger
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import threading
+import time
+from uuid import uuid4
 
-from flask import current_app
-from flask.ext.sqlalchemy import SQLAlchemy
-from sqlalchemy.event import listens_for
-from sqlalchemy.pool import Pool
+from flask import current_app, has_request_context, make_response, request, url_for
+from flask.ext.sqlalchemy import SignallingSession, SQLAlchemy
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import requests
+from sqlalchemy.sql.expression import Select
+
+from github_status.cache import create_cache, MemoryCache
+from github_status.pool import MeteredQueuePool
+from github_status.rate_limit import RateLimiter
+from github_status.static_assets import load_manifest
 
 LOG = getLogger(__name__)
+READ_PRIMARY_COOKIE = 'read_primary_until'
+WROTE_TO_DATABASE = 'github_status.wrote_to_database'  # WSGI environ key, flask.g outlives requests.
+
+
+class Workers(object):
+    """Per-process bounded thread pool used to run blocking I/O (e.g. GitHub API calls) concurrently.
+
+    The pool is created lazily on first use, and created again in forked children since threads don't survive a fork
+    (prodserver forks after the application is initialized).
+
+    Functions running in a pool must never wait on other functions submitted to the same pool, or the pool may deadlock
+    when it's full. Use a separate instance for nested work.
+
+    Keyword arguments:
+    config_key -- Flask config key holding the pool size.
+    """
+
+    def __init__(self, config_key='WORKERS_POOL_SIZE'):
+        self.config_key = config_key
+        self.size = 1
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._scheduled = 0
+        self._scheduled_done = threading.Condition()
+
+    def init_app(self, app):
+        self.size = app.config[self.config_key]
+
+    @property
+    def pool(self):
+        """The ThreadPool instance belonging to the current process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ThreadPool(self.size)
+                self._pid = os.getpid()
+        return self._pool
+
+    def submit(self, func, *args, **kwargs):
+        """Runs a function in the pool within the current Flask application context.
+
+        Positional arguments:
+        func -- the function to call. Remaining arguments are passed to it.
+
+        Returns:
+        multiprocessing.pool.AsyncResult instance.
+        """
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                return func(*args, **kwargs)
+        return self.pool.apply_async(run)
+
+    def imap_unordered(self, func, iterable):
+        """Runs a function in the pool for every item in an iterable, within the current Flask application context.
+
+        Positional arguments:
+        func -- the function to call with one argument.
+        iterable -- items to pass to the function.
+
+        Returns:
+        Iterator yielding return values as soon as they're available, in any order. Its next() method accepts a timeout.
+        """
+        app = current_app._get_current_object()
+
+        def run(item):
+            with app.app_context():
+                return func(item)
+        return self.pool.imap_unordered(run, iterable)
+
+    def submit_later(self, delay, func, *args, **kwargs):
+        """Same as submit(), but waits in a timer thread first. No pool thread is occupied while waiting.
+
+        Positional arguments:
+        delay -- seconds to wait before submitting.
+        func -- the function to call. Remaining arguments are passed to it.
+
+        Returns:
+        threading.Timer instance (already started).
+        """
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.submit(func, *args, **kwargs).wait()  # Counted as scheduled until it returns.
+            finally:
+                with self._scheduled_done:
+                    self._scheduled -= 1
+                    self._scheduled_done.notify_all()
+        with self._scheduled_done:
+            self._scheduled += 1
+        timer = threading.Timer(delay, run)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def wait_scheduled(self, timeout=None):
+        """Blocks until all functions passed to submit_later() returned, including the ones they passed to
+        submit_later() in turn (e.g. retries). Timers are daemon threads, call before exiting to let them finish.
+
+        Keyword arguments:
+        timeout -- seconds to wait at most, None to wait for as long as it takes.
+
+        Returns:
+        True if all of them returned, False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._scheduled_done:
+            while self._scheduled:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._scheduled_done.wait(remaining if remaining is not None else 1)  # Stays interruptible (Ctrl-C).
+        return True
+
+    @staticmethod
+    def wait_all(results, timeout):
+        """Waits for all submitted functions to return, sharing one overall deadline.
+
+        Raises:
+        multiprocessing.TimeoutError -- raised if the deadline is hit before all functions returned.
+
+        Positional arguments:
+        results -- list of AsyncResult instances returned by submit().
+        timeout -- deadline in seconds for all of them combined.
+
+        Returns:
+        List of return values in the same order as `results`. Exceptions raised by the functions are re-raised here.
+        """
+        deadline = time.time() + timeout
+        return [r.get(max(deadline - time.time(), 0)) for r in results]
+
+
+class GitHub(object):
+    """Shared HTTP client for all GitHub API calls, with keep-alive connection pooling, timeouts, and retries.
+
+    One requests.Session is kept per process. Like Workers, it's created lazily and created again in forked children so
+    Tornado's sub-processes never share sockets inherited from the parent.
+
+    Parsed responses may also be cached along with their ETag/Last-Modified validators (see get_cached()), in the
+    backend chosen by GITHUB_CACHE_BACKEND.
+
+    Every call goes through the rate limiter, which picks one of the GITHUB_TOKENS and waits for quota if needed.
+    """
+
+    def __init__(self):
+        self.pool_size = 10
+        self.timeout = None
+        self.retries = 0
+        self.retry_backoff = 0
+        self.cache = None
+        self.limiter = RateLimiter(list(), 0)
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.pool_size = app.config['GITHUB_POOL_SIZE']
+        self.timeout = app.config['GITHUB_TIMEOUT']
+        self.retries = app.config['GITHUB_RETRIES']
+        self.retry_backoff = app.config['GITHUB_RETRY_BACKOFF']
+        self.cache = create_cache(app.config['GITHUB_CACHE_BACKEND'], app.config['GITHUB_CACHE_PATH'],
+                                  app.config['GITHUB_CACHE_SIZE'])
+        self.limiter = RateLimiter(app.config['GITHUB_TOKENS'], app.config['GITHUB_RATE_LIMIT_MAX_WAIT'])
+        with self._lock:
+            self._pid = None  # Settings may have changed, start over with a new session.
+
+    @property
+    def session(self):
+        """The requests.Session instance belonging to the current process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                retry = Retry(total=self.retries, backoff_factor=self.retry_backoff)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                self._session = requests.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+                self._pid = os.getpid()
+        return self._session
+
+    def get(self, url, **kwargs):
+        """Sends a GET request through the shared session. Keyword arguments are passed to requests.Session.get().
+
+        Raises:
+        github_status.rate_limit.RateLimitError -- raised if the rate limit quota won't reset soon enough.
+
+        Positional arguments:
+        url -- the URL to query.
+
+        Returns:
+        requests.Response instance.
+        """
+        headers = dict(kwargs.pop('headers', None) or dict())
+        kwargs.setdefault('timeout', self.timeout)
+        while True:
+            token = self.limiter.acquire()  # Raises once the used-up quotas reset too late (see RateLimiter.update()).
+            if token:
+                headers['Authorization'] = 'token {}'.format(token)
+            response = self.session.get(url, headers=headers, **kwargs)
+            self.limiter.update(token, response.headers)
+            if response.status_code == 403 and response.headers.get('X-RateLimit-Remaining') == '0':
+                response.close()
+                continue  # Quota used up elsewhere (other processes or hosts). Wait for a reset or use another token.
+            return response
+
+    def get_cached(self, url, parse, **kwargs):
+        """Sends a conditional GET request if the URL is cached, skipping parse() if GitHub responds with 304.
+
+        Only responses with an ETag or Last-Modified header are cached. If parse() raises an exception nothing is
+        cached. Other keyword arguments are passed to get() (e.g. stream=True to let parse() read the body
+        incrementally).
+
+        Positional arguments:
+        url -- the URL to query, also the cache key.
+        parse -- function called with the requests.Response instance of non-304 responses. Its return value is cached.
+
+        Returns:
+        Return value of parse(), either from this response or the cached one.
+        """
+        entry = self.cache.get(url) if self.cache else None
+        headers = dict()
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.get(url, headers=headers, **kwargs)
+        try:
+            if entry and response.status_code == 304:
+                return entry['value']
+            value = parse(response)
+        finally:
+            response.close()  # Returns streamed connections to the pool.
 
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if self.cache and response.status_code == 200 and (etag or last_modified):
+            self.cache.set(url, dict(etag=etag, last_modified=last_modified, value=value))
+        return value
 
-@listens_for(Pool, 'connect', named=True)
-def _on_connect(dbapi_connection, **_):
-    """Set MySQL mode to TRADITIONAL on databases that don't set this automatically.
 
-    Without this, MySQL will silently insert invalid values in the database, causing very long debugging sessions in the
-    long run.
-    http://www.enricozini.org/2012/tips/sa-sqlmode-traditional/
+class PageCache(object):
+    """Caches rendered responses of read-only views, invalidated whenever a repository is written to the database.
+
+    Entries are grouped in scopes (e.g. the listing, or one repo's details page). Each scope has a random generation
+    which is part of its entries' keys, so invalidating a scope is one write (a new generation) no matter how many URLs
+    it covers. Stale entries are never read again and get evicted as least recently used. Views read the generation
+    before querying the database, so responses rendered while a write commits are stored under the old generation.
+
+    Entries are looked up in the in-process PAGE_CACHE_BACKEND first, then in the PAGE_CACHE_SHARED_BACKEND. Generations
+    are kept in a second store of the shared backend if there is one (PAGE_CACHE_PATH with a .generations suffix), so
+    writes in any process (prodserver's children, the refresh command) invalidate every process' entries. Otherwise
+    only writes in the current process are seen. Generations are read on every request, so that store's reads don't
+    write (lru=False) and pages never evict generations.
+    """
+
+    def __init__(self):
+        self.local = None
+        self.shared = None
+        self.generations = None
+
+    def init_app(self, app):
+        size = app.config['PAGE_CACHE_SIZE']
+        self.local = create_cache(app.config['PAGE_CACHE_BACKEND'], None, size)
+        backend, path = app.config['PAGE_CACHE_SHARED_BACKEND'], app.config['PAGE_CACHE_PATH']
+        self.shared = create_cache(backend, path, size)
+        if self.shared:
+            self.generations = create_cache(backend, '{}.generations'.format(path), size, lru=False)
+        else:
+            self.generations = MemoryCache(size)
+
+    @property
+    def enabled(self):
+        return bool(self.local or self.shared)
+
+    def key(self, scope, name):
+        """Returns the cache key of an entry in a scope. Call before querying the database (see class docstring).
+
+        Positional arguments:
+        scope -- the scope's name, case insensitive.
+        name -- identifies the entry within the scope, usually the request's path and query string.
+
+        Returns:
+        String to pass to get() and set().
+        """
+        generation_key = 'generation:{}'.format(scope.lower())
+        generation = self.generations.get(generation_key)
+        if generation is None:
+            # New or evicted scope. Entries from before the eviction could be stale, start a new generation.
+            generation = uuid4().hex
+            self.generations.set(generation_key, generation)
+        return 'page:{}:{}:{}'.format(scope.lower(), generation, name)
+
+    def get(self, key):
+        value = self.local.get(key) if self.local else None
+        if value is None and self.shared:
+            value = self.shared.get(key)
+            if value is not None and self.local:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        for cache in (self.local, self.shared):
+            if cache:
+                cache.set(key, value)
+
+    def invalidate(self, repo_url):
+        """Invalidates cached pages showing a repository: the listing ('repos' scope) and its details ('repo:<url>').
+
+        Positional arguments:
+        repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+        """
+        if not self.enabled:
+            return
+        for scope in ('repos', 'repo:{}'.format(repo_url)):
+            self.generations.set('generation:{}'.format(scope.lower()), uuid4().hex)
+
+    def cached(self, scope, version=None):
+        """Decorator which caches a view's HTTP 200 responses by URL (path and query string).
+
+        A read replica may still return data from before a write after the write's invalidation, and the response
+        rendered from it would be stored under the new generation. With version, entries are also keyed on the version
+        of the data read in the view's session (the same replica, see RoutingSession), so lagging responses are never
+        served once the replica caught up.
+
+        Positional arguments:
+        scope -- function called with the view's arguments, returns the name of the scope the response belongs to.
+
+        Keyword arguments:
+        version -- function called with the view's arguments, same as the one of views.helpers.conditional().
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+                key = self.key(scope(*args, **kwargs), request.full_path)
+                if version:
+                    key = '{}#{}'.format(key, (version(*args, **kwargs) or ('', ))[0])
+                entry = self.get(key)
+                if entry is not None:
+                    return current_app.response_class(entry['data'], content_type=entry['content_type'])
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.set(key, dict(data=response.get_data(), content_type=response.headers['Content-Type']))
+                return response
+            return wrapped
+        return decorator
+
+
+class StaticFiles(object):
+    """Links templates to the content-hashed static files written by `manage.py build_static`.
+
+    If STATIC_BUILD_FOLDER holds a build, Flask (and prodserver) serve static files from there instead of the static
+    folder, and static_url() returns URLs of hashed files. Otherwise it's the same as url_for('static', ...).
     """
-    if not current_app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite://'):
-        LOG.debug('Setting SQL Mode to TRADITIONAL.')
-        dbapi_connection.cursor().execute("SET SESSION sql_mode='TRADITIONAL'")
+
+    def __init__(self):
+        self.manifest = None
+
+    def init_app(self, app):
+        self.manifest = load_manifest(app.config['STATIC_BUILD_FOLDER'])
+        if self.manifest is not None:
+            app.static_folder = os.path.abspath(app.config['STATIC_BUILD_FOLDER'])
+        app.add_template_global(self.url, 'static_url')
+
+    def url(self, filename, **kwargs):
+        """Returns the URL of a static file, hashed if it's in the build. Keyword arguments are passed to url_for().
+
+        Positional arguments:
+        filename -- path relative to the static folder (e.g. bootstrap/css/bootstrap.min.css).
+        """
+        return url_for('static', filename=(self.manifest or dict()).get(filename, filename), **kwargs)
+
+
+class RoutingSession(SignallingSession):
+    """Session which sends SELECT statements of read-only requests (GET and HEAD) to a read replica. The replica is
+    picked at random once per session (request), so all of a request's reads see the same replication state.
+
+    Everything else goes to the primary: writes, requests which may write (e.g. POST), and code running outside of
+    requests (background jobs, the refresh scheduler). Once a session writes it reads from the primary until it commits
+    or rolls back, and for the rest of the request once committed.
+
+    The writing client's later requests, in any process, also read from the primary for DB_READ_YOUR_WRITES seconds
+    through a cookie, so replication lag never hides a write from the client that made it. Other clients keep reading
+    from replicas.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self._replica = None
+        self._wrote = False
+        super(RoutingSession, self).__init__(db, **options)
+
+    def _read_from_replica(self, clause):
+        """Returns True if the statement may be sent to a replica."""
+        if not self.db.replica_binds or self._wrote or not isinstance(clause, Select):
+            return False
+        if not has_request_context() or request.method not in ('GET', 'HEAD') or request.environ.get(WROTE_TO_DATABASE):
+            return False
+        try:
+            return time.time() >= float(request.cookies.get(READ_PRIMARY_COOKIE, 0))
+        except ValueError:
+            return True
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._read_from_replica(clause):
+            if self._replica is None:
+                self._replica = random.choice(self.db.replica_binds)
+            return self.db.get_engine(self.app, bind=self._replica)
+        if clause is not None and not isinstance(clause, Select):
+            self._wrote = True
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self._wrote = True
+        super(RoutingSession, self).flush(objects)
+
+    def commit(self):
+        super(RoutingSession, self).commit()
+        if self._wrote and has_request_context():
+            request.environ[WROTE_TO_DATABASE] = True  # See Database.set_read_primary_cookie().
+        self._wrote = False
+
+    def rollback(self):
+        super(RoutingSession, self).rollback()
+        self._wrote = False
+
+    def close(self):
+        super(RoutingSession, self).close()
+        self._replica = None  # Called by remove() when the request ends.
+        self._wrote = False
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy with the connection pool from github_status.pool for MySQL.
+
+    Pool size, overflow, timeout, and recycle come from Flask-SQLAlchemy's own SQLALCHEMY_POOL_* and
+    SQLALCHEMY_MAX_OVERFLOW options, pre-ping from DB_POOL_PRE_PING.
+
+    MySQL connections also set the SQL mode to TRADITIONAL on databases that don't set this automatically. Without
+    this, MySQL will silently insert invalid values in the database, causing very long debugging sessions in the long
+    run. http://www.enricozini.org/2012/tips/sa-sqlmode-traditional/
+    The driver runs it while connecting (init_command), so no extra round trip or application context is needed.
+
+    Read replicas listed in DB_REPLICA_URIS are added to SQLALCHEMY_BINDS as replica0, replica1, etc. and used by
+    RoutingSession.
+    """
+
+    def __init__(self, **kwargs):
+        self.replica_binds = list()
+        self.read_your_writes = 0
+        super(Database, self).__init__(**kwargs)
+
+    def init_app(self, app):
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or dict())
+        for i, uri in enumerate(app.config['DB_REPLICA_URIS']):
+            binds['replica{}'.format(i)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        self.replica_binds = sorted(k for k in binds if k.startswith('replica'))
+        self.read_your_writes = app.config['DB_READ_YOUR_WRITES']
+        super(Database, self).init_app(app)
+        app.after_request(self.set_read_primary_cookie)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def set_read_primary_cookie(self, response):
+        """Makes the client read from the primary for a while after a request which wrote to the database."""
+        if self.replica_binds and request.environ.get(WROTE_TO_DATABASE):
+            response.set_cookie(READ_PRIMARY_COOKIE, repr(time.time() + self.read_your_writes),
+                                max_age=int(math.ceil(self.read_your_writes)))
+        return response
+
+    def apply_driver_hacks(self, app, info, options):
+        super(Database, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('mysql'):
+            LOG.debug('Setting SQL Mode to TRADITIONAL.')
+            connect_args = options.setdefault('connect_args', dict())
+            connect_args['init_command'] = "SET SESSION sql_mode='TRADITIONAL'"
+            options.update(poolclass=MeteredQueuePool, pre_ping=app.config['DB_POOL_PRE_PING'])
 
 
-db = SQLAlchemy()
+api_workers = Workers('API_WORKERS_POOL_SIZE')  # Runs async API requests, which wait on the `workers` pool.
+db = Database()
+github = GitHub()
+page_cache = PageCache()
+page_workers = Workers('GITHUB_PAGE_WORKERS_POOL_SIZE')  # Prefetches pages, runs nested in the `workers` pool.
+static_files = StaticFiles()
+workers = Workers()
@@ -1,8 +1,32 @@
 """Convenience functions which interact with SQLAlchemy models."""
 
-from sqlalchemy import func
+from contextlib import contextmanager
+import hashlib
+import re
+
+from sqlalchemy import and_, bindparam, func, inspect, or_, select
+from sqlalchemy.exc import IntegrityError
 
 from github_status.extensions import db
+from github_status.models.repositories import Repository, summarize
+from github_status.models.versions import TableVersion
+
+
+def _filter(query, column, value, glob):
+    """Adds a case-insensitive filter to a query for count() and exists().
+
+    If the column's model has a normalized `<column>_lower` column (e.g. Repository.url_lower) it's used instead, so the
+    database can use its index. Globs starting with a literal prefix are then matched with an indexed range scan too.
+    """
+    lowered = getattr(column.class_, '{}_lower'.format(column.key), None)
+    if lowered is None:
+        return query.filter(column.ilike(value) if glob else func.lower(column) == value.lower())
+    if not glob:
+        return query.filter(lowered == value.lower())
+    prefix = re.split(r'[%_\\]', value.lower(), 1)[0]
+    if prefix:
+        query = query.filter(lowered >= prefix, lowered < prefix[:-1] + unichr(ord(prefix[-1]) + 1))
+    return query.filter(lowered.like(value.lower()))
 
 
 def count(column, value, glob=False):
@@ -18,9 +42,193 @@ def count(column, value, glob=False):
     Returns:
     Number of rows that match. Equivalent of SELECT count(*) FROM.
     """
-    query = db.session.query(func.count('*'))
-    if glob:
-        query = query.filter(column.ilike(value))
-    else:
-        query = query.filter(func.lower(column) == value.lower())
-    return query.one()[0]
+    return _filter(db.session.query(func.count('*')), column, value, glob).one()[0]
+
+
+def exists(column, value, glob=False):
+    """Like count() but only checks if there is at least one matching row, stopping at the first one.
+
+    Positional arguments:
+    column -- the SQLAlchemy column object to search in (e.g. Table.a_column).
+    value -- the value to search for, any string.
+
+    Keyword arguments:
+    glob -- enable %globbing% search (default False).
+
+    Returns:
+    True if a row matches, False otherwise. Equivalent of SELECT EXISTS (SELECT ... FROM).
+    """
+    return bool(db.session.query(_filter(db.session.query(column), column, value, glob).exists()).scalar())
+
+
+@contextmanager
+def advisory_lock(name, timeout):
+    """Holds a named lock shared by all processes using the database, such as all of prodserver's forked children.
+
+    Uses MySQL's GET_LOCK() on a dedicated connection. Other databases (SQLite) don't support these locks, then this
+    does nothing. If the lock isn't acquired within the timeout the block runs anyway, unlocked.
+
+    Positional arguments:
+    name -- any string identifying the lock.
+    timeout -- seconds to wait for the lock.
+
+    Yields:
+    True if the lock is held, False otherwise.
+    """
+    if db.engine.dialect.name != 'mysql':
+        yield False
+        return
+    name = 'github_status:{}'.format(hashlib.sha1(name.encode('utf-8')).hexdigest())  # MySQL limits names to 64 chars.
+    connection = db.engine.connect()
+    try:
+        locked = bool(connection.execute(select([func.get_lock(name, timeout)])).scalar())
+        try:
+            yield locked
+        finally:
+            if locked:
+                connection.execute(select([func.release_lock(name)]))
+    finally:
+        connection.close()
+
+
+def upsert(model, values, key, insert=True, update=True, counter=None):
+    """Inserts a row, or updates the existing row with the same unique key, without racing concurrent writers.
+
+    Tries an UPDATE first, then an INSERT. If the INSERT fails because a concurrent transaction inserted the same key in
+    between, the existing row is updated (or left alone if update is False). Other constraint violations (e.g. NOT NULL)
+    are raised. A failed statement doesn't abort the transaction in MySQL (InnoDB) or SQLite. Nothing is committed.
+
+    Raises:
+    sqlalchemy.exc.IntegrityError -- raised on constraint violations other than the unique key.
+
+    Positional arguments:
+    model -- the SQLAlchemy model class (e.g. Repository).
+    values -- dictionary of column names and values, including the key column.
+    key -- name of the column with a unique index to match existing rows with.
+
+    Keyword arguments:
+    insert -- insert the row if it doesn't exist, otherwise nothing is written (default True).
+    update -- update the row if it exists, otherwise nothing is written (default True).
+    counter -- name of an integer column set to 1 on insert and incremented on update (NULL counts as 0).
+
+    Returns:
+    'inserted' or 'updated', or None if nothing was written.
+    """
+    table = model.__table__
+    statement = table.update().where(table.c[key] == values[key]).values(values)
+    if counter:
+        statement = statement.values({counter: func.coalesce(table.c[counter], 0) + 1})
+        values = dict(values, **{counter: 1})
+    if update and db.session.execute(statement).rowcount:  # Matched rows, even if no value changed (CLIENT_FOUND_ROWS).
+        return 'updated'
+    if not insert:
+        return None
+    try:
+        db.session.execute(table.insert().values(values))  # Core, so Python-side column defaults apply.
+    except IntegrityError:
+        # Locking read, sees rows committed after this transaction's snapshot (MySQL's REPEATABLE READ).
+        existing = select([table.c[key]]).where(table.c[key] == values[key]).with_for_update(read=True)
+        if db.session.execute(existing).first() is None:
+            raise
+        if update and db.session.execute(statement).rowcount:
+            return 'updated'
+        return None
+    return 'inserted'
+
+
+def bump_version(model):
+    """Increments the TableVersion of a model's table in the current transaction. Call it whenever rows are inserted,
+    updated or deleted. Concurrent writers wait on the version's row lock until this transaction ends, commit soon.
+
+    Positional arguments:
+    model -- the SQLAlchemy model class (e.g. Repository).
+    """
+    table = TableVersion.__table__
+    statement = table.update().where(table.c.name == model.__tablename__).values(version=table.c.version + 1)
+    if db.session.execute(statement).rowcount:
+        return
+    if not upsert(TableVersion, dict(name=model.__tablename__, version=1), 'name', update=False):
+        db.session.execute(statement)  # Inserted by a concurrent transaction.
+
+
+def repository_version(repo_url=None):
+    """Cheap version of all Repository rows or of one row, for HTTP validators (see views.helpers.conditional()).
+
+    Every write sets last_refreshed and bumps the table's TableVersion (see bump_version()). The listing's version is
+    two index lookups instead of a count: the TableVersion row and max(last_refreshed). A row's version also includes
+    its write counter, so two writes within the same second (MySQL's DATETIME resolution) don't share one.
+
+    Keyword arguments:
+    repo_url -- the version of this repo's row instead of the whole table.
+
+    Returns:
+    Tuple of a version string and the datetime of the last write (may be None), or None if the row doesn't exist.
+    """
+    if repo_url is None:
+        writes = select([TableVersion.version]).where(TableVersion.name == Repository.__tablename__).as_scalar()
+        writes, last_refreshed = db.session.query(writes, func.max(Repository.last_refreshed)).one()
+        return '{}:{}'.format(writes or 0, last_refreshed), last_refreshed
+    columns = (Repository.id, Repository.writes, Repository.last_refreshed)
+    row = db.session.query(*columns).filter_by(url_lower=repo_url.lower()).first()
+    return ('{}:{}:{}'.format(*row), row[2]) if row else None
+
+
+def add_missing_columns(table):
+    """Adds columns and indexes defined in a model but missing from its existing database table.
+
+    db.create_all() only creates missing tables. This handles the other half of schema changes for this application,
+    which only ever adds nullable columns.
+
+    Positional arguments:
+    table -- the SQLAlchemy table object (e.g. Model.__table__).
+
+    Returns:
+    List of names of the added columns and indexes.
+    """
+    inspector = inspect(db.engine)
+    existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+    added = list()
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+        column_type = column.type.compile(dialect=db.engine.dialect)
+        db.session.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table.name, column.name, column_type))
+        added.append(column.name)
+    db.session.commit()
+
+    existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            index.create(db.engine)
+            added.append(index.name)
+    return added
+
+
+def backfill_computed_columns(batch_size):
+    """Fills in Repository columns computed from other columns (url_lower and last_commit_summary) for rows saved
+    before they existed.
+
+    Positional arguments:
+    batch_size -- number of rows read and updated per transaction.
+
+    Returns:
+    Number of updated rows.
+    """
+    table, updated, last_id = Repository.__table__, 0, 0
+    statement = table.update().where(table.c.id == bindparam('b_id'))
+    missing = or_(Repository.url_lower.is_(None),
+                  and_(Repository.last_commit_summary.is_(None), Repository.last_commit.isnot(None)))
+    while True:
+        columns = (Repository.id, Repository.url, Repository.last_commit, Repository.last_commit_summary)
+        rows = db.session.query(*columns).filter(Repository.id > last_id, missing).order_by(Repository.id)
+        rows = rows.limit(batch_size).all()
+        if not rows:
+            return updated
+        db.session.execute(statement, [
+            dict(b_id=i, url_lower=u.lower(), last_commit_summary=c and summarize(c) if summary is None else summary)
+            for i, u, c, summary in rows
+        ])
+        bump_version(Repository)
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
@@ -0,0 +1,22 @@
+"""Background jobs waiting on GitHub to generate repository statistics."""
+
+from datetime import datetime
+import uuid
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from github_status.extensions import db
+
+
+class Job(db.Model):
+    """Tracks a repository's line count being fetched in the background. Stored in the database so any process may
+    report on a job's status.
+    """
+
+    id = Column(String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    repo_url = Column(String(255), nullable=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending, done, or failed.
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String(255), nullable=False, default='')
+    created = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,15 +1,33 @@
 """Holds all metadata for each GitHub repository being tracked."""
 
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, DateTime, Integer, String, Text
 
 from github_status.extensions import db
 
+SUMMARY_LENGTH = 80
+
+
+def _url_lower(context):
+    """Default value of Repository.url_lower on insert."""
+    return context.current_parameters['url'].lower()
+
 
 class Repository(db.Model):
     """Holds all metadata for each GitHub repository being tracked."""
 
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=True)
     url = Column(String(255), unique=True, nullable=False)
+    url_lower = Column(String(255), index=True, unique=True, default=_url_lower)  # For case-insensitive lookups.
     line_count = Column(Integer)
+    line_count_week = Column(Integer)  # UNIX timestamp of the last week summed up in line_count_totals.
+    line_count_totals = Column(Text)  # JSON object, each contributor's line count up to line_count_week.
     top_committers = Column(String(255))
     last_commit = Column(Text)
+    last_commit_summary = Column(String(SUMMARY_LENGTH), index=True)  # See summarize(). Listed instead of last_commit.
+    last_refreshed = Column(DateTime, index=True)  # UTC. The refresh scheduler picks the stalest rows first.
+    writes = Column(Integer)  # Incremented by every write, last_refreshed alone misses writes within one second.
+
+
+def summarize(last_commit):
+    """Returns the first line of a commit message, truncated to fit in Repository.last_commit_summary."""
+    return (last_commit or '').split('\n', 1)[0].strip()[:SUMMARY_LENGTH]
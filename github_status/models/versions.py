@@ -0,0 +1,12 @@
+"""Counts writes to tables, so HTTP validators don't have to scan them."""
+
+from sqlalchemy import Column, Integer, String
+
+from github_status.extensions import db
+
+
+class TableVersion(db.Model):
+    """Version of a table, incremented by models.helpers.bump_version() in every transaction writing to the table."""
+
+    name = Column(String(64), primary_key=True)  # Table name (e.g. Repository.__tablename__).
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,115 @@
+"""Database connection pool with checkout metrics, pre-ping, and fork safety.
+
+prodserver forks into several processes after the application is initialized. Sockets of connections opened before the
+fork would be shared by all children, so connections remember the process which opened them and are replaced when
+checked out by another process.
+
+MySQL also closes connections idle for longer than its wait_timeout, causing "MySQL server has gone away" errors on the
+next query. With pre_ping every checkout tests the connection first and replaces it if it's dead.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, TimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics(object):
+    """Thread-safe counters of one process' connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict(checkouts=0, connects=0, disconnects=0, timeouts=0, wait_seconds=0.0,
+                              max_wait_seconds=0.0)
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self._counters[name] += value
+
+    def checkout(self, seconds, timed_out):
+        """Records one checkout and how long it waited for a connection (including connecting and pinging)."""
+        with self._lock:
+            self._counters['checkouts' if not timed_out else 'timeouts'] += 1
+            self._counters['wait_seconds'] += seconds
+            self._counters['max_wait_seconds'] = max(self._counters['max_wait_seconds'], seconds)
+
+    def snapshot(self):
+        """Returns a copy of all counters."""
+        with self._lock:
+            return dict(self._counters)
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool which records metrics, never hands out connections opened by another process, and optionally tests
+    connections before handing them out.
+
+    Keyword arguments are picked up from create_engine()'s keyword arguments by SQLAlchemy.
+
+    Keyword arguments:
+    pre_ping -- run SELECT 1 on every checkout, replacing connections closed by the server (default False).
+    metrics -- PoolMetrics instance, shared with pools recreated by Engine.dispose(). New one if None.
+    """
+
+    def __init__(self, creator, pre_ping=False, metrics=None, **kwargs):
+        super(MeteredQueuePool, self).__init__(creator, **kwargs)
+        self.pre_ping = pre_ping
+        self.metrics = metrics or PoolMetrics()
+        if '_dispatch' not in kwargs:  # Recreated pools get the same listeners.
+            event.listen(self, 'connect', self._on_connect)
+            event.listen(self, 'checkout', self._on_checkout)
+
+    def recreate(self):
+        pool = super(MeteredQueuePool, self).recreate()
+        pool.pre_ping, pool.metrics = self.pre_ping, self.metrics
+        return pool
+
+    def connect(self):
+        start = time.time()
+        try:
+            connection = super(MeteredQueuePool, self).connect()
+        except TimeoutError:
+            self.metrics.checkout(time.time() - start, True)
+            raise
+        self.metrics.checkout(time.time() - start, False)
+        return connection
+
+    def _on_connect(self, _, connection_record):
+        """Remembers which process opened a new connection."""
+        connection_record.info['pid'] = os.getpid()
+        self.metrics.add(connects=1)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        """Replaces connections opened by another process, and dead connections if pre_ping is enabled.
+
+        Raising DisconnectionError makes the pool discard the connection and retry with a new one.
+        """
+        if connection_record.info['pid'] != os.getpid():
+            # Opened before a fork. Forget it without closing it, the socket belongs to the parent.
+            connection_record.connection = connection_proxy.connection = None
+            self.metrics.add(disconnects=1)
+            raise DisconnectionError('Connection record belongs to pid {}, attempting to check out in pid {}.'.format(
+                connection_record.info['pid'], os.getpid()))
+        if not self.pre_ping:
+            return
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            self.metrics.add(disconnects=1)
+            raise DisconnectionError('Connection failed pre-ping.')
+
+    def stats(self):
+        """Returns the metrics and the current state of the pool.
+
+        Returns:
+        Dictionary of the PoolMetrics counters plus size, checked_in, checked_out, and overflow.
+        """
+        stats = self.metrics.snapshot()
+        stats.update(size=self.size(), checked_in=self.checkedin(), checked_out=self.checkedout(),
+                     overflow=self.overflow())
+        return stats
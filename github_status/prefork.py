@@ -0,0 +1,269 @@
+"""Prefork process model of prodserver: a master process supervising children which serve HTTP on shared sockets.
+
+Unlike Tornado's HTTPServer.start(), the master:
+- forks a configurable number of children, after the application was initialized and warmed up so they share those
+  memory pages copy-on-write (see github_status.application.warm_up()).
+- replaces children which crash, or exit after serving max_requests requests.
+- reloads on SIGHUP without dropping connections: it executes itself again, keeping its PID, children, and listening
+  sockets. The new master loads the deployed code and replaces the old children one by one, each finishing its in-flight
+  requests before exiting.
+- stops gracefully on SIGTERM and SIGINT.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import weakref
+
+from tornado import httpserver, ioloop
+from tornado.platform.auto import set_close_exec
+from tornado.process import cpu_count
+
+LOG = logging.getLogger(__name__)
+LISTEN_FDS = 'GITHUB_STATUS_LISTEN_FDS'  # Environment variables passed from the old master to the new one on SIGHUP.
+RETIRE_PIDS = 'GITHUB_STATUS_RETIRE_PIDS'
+
+
+def inherited_sockets():
+    """Returns the listening sockets inherited from the old master after a SIGHUP reload.
+
+    Returns:
+    List of socket instances, empty if the process wasn't started by a reload.
+    """
+    sockets = list()
+    for item in [i for i in os.environ.pop(LISTEN_FDS, '').split(',') if i]:
+        fd, family = (int(i) for i in item.split(':'))
+        sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+        os.close(fd)  # fromfd() duplicated it.
+        set_close_exec(sock.fileno())
+        sock.setblocking(0)
+        sockets.append(sock)
+    return sockets
+
+
+def _clear_close_exec(fd):
+    """Lets a file descriptor survive os.execv(). Opposite of tornado.platform.auto.set_close_exec()."""
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+
+
+class _CountingHTTPServer(httpserver.HTTPServer):
+    """HTTPServer which counts requests, and in-flight requests so it can finish them before exiting.
+
+    New connections count as in-flight right away since they were accepted to send a request. Keep-alive connections
+    waiting for their next request don't.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_CountingHTTPServer, self).__init__(*args, **kwargs)
+        self.requests = 0
+        self.in_flight = 0
+        self.on_request = lambda: None
+        self._ends = weakref.WeakKeyDictionary()  # Connection: function ending its current request.
+
+    def start_request(self, server_conn, request_conn):
+        adapter = super(_CountingHTTPServer, self).start_request(server_conn, request_conn)
+        headers_received, finish = adapter.headers_received, request_conn.finish
+        state = list()
+
+        def begin():
+            if not state:
+                state.append('started')
+                self.in_flight += 1
+
+        def end():
+            if state == ['started']:
+                state.append('ended')
+                self.in_flight -= 1
+
+        def wrapped_headers_received(start_line, headers):
+            begin()
+            self.requests += 1
+            self.on_request()
+            return headers_received(start_line, headers)
+
+        def wrapped_finish():
+            try:
+                return finish()
+            finally:
+                end()
+
+        if server_conn not in self._ends:
+            begin()
+        self._ends[server_conn] = end
+        adapter.headers_received = wrapped_headers_received
+        request_conn.finish = wrapped_finish
+        return adapter
+
+    def on_close(self, server_conn):
+        self._ends.pop(server_conn, lambda: None)()  # Client went away before the response was finished.
+        super(_CountingHTTPServer, self).on_close(server_conn)
+
+    @property
+    def busy(self):
+        """True while requests are being served or responses are still being sent."""
+        return bool(self.in_flight) or any(c.stream.writing() for c in self._connections if c.stream)
+
+
+class PreforkServer(object):
+    """Master process forking and supervising children which serve a Tornado application.
+
+    Positional arguments:
+    application -- tornado.web.Application instance to serve.
+    sockets -- listening sockets, from tornado.netutil.bind_sockets() or inherited_sockets().
+
+    Keyword arguments:
+    processes -- number of children, one per CPU if 0.
+    max_requests -- children exit after serving this many requests and are replaced, 0 for no limit.
+    graceful_timeout -- seconds stopping children may take to finish in-flight requests.
+    argv -- command line of the new master on SIGHUP. Defaults to the current one.
+    on_child_start -- function called in every child right after it's forked, before serving (e.g. to start background
+        threads, which don't survive a fork).
+    """
+
+    def __init__(self, application, sockets, processes=0, max_requests=0, graceful_timeout=30, argv=None,
+                 on_child_start=None):
+        self.application = application
+        self.sockets = sockets
+        self.processes = processes or cpu_count()
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.argv = argv or [sys.executable] + sys.argv
+        self.on_child_start = on_child_start
+        self.children = dict()  # PID: True for children of the current master, False for children of the old master.
+        self.retiring = None  # PID of the old child being stopped.
+        self.stopping = False
+        self._signal = None  # Received, not yet handled.
+
+    def run(self):
+        """Forks children and supervises them until SIGTERM or SIGINT. Never returns in children."""
+        retire = [int(p) for p in os.environ.pop(RETIRE_PIDS, '').split(',') if p]
+        self.children.update((pid, False) for pid in retire)
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._handle_signal)
+        LOG.info('Master {} starting {} processes.'.format(os.getpid(), self.processes))
+        self._maintain()
+
+        while self.children:
+            self._handle_pending_signal()
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue  # Interrupted by a signal.
+            self._reap(pid, status)
+            if not self.stopping:
+                self._maintain()
+        LOG.info('Master {} stopped.'.format(os.getpid()))
+
+    def _handle_signal(self, signum, _):
+        if self._signal != signal.SIGTERM:  # Stopping wins over reloading.
+            self._signal = signal.SIGTERM if signum == signal.SIGINT else signum
+
+    def _handle_pending_signal(self):
+        signum, self._signal = self._signal, None
+        if self.stopping or signum is None:
+            return
+        if signum == signal.SIGHUP:
+            self.reload()
+        else:
+            LOG.info('Master {} stopping {} processes.'.format(os.getpid(), len(self.children)))
+            self.stopping = True
+            for pid in self.children:
+                self._kill(pid)
+
+    def _reap(self, pid, status):
+        """Handles an exited child."""
+        if self.children.pop(pid, None) is None or self.stopping:
+            return
+        if pid == self.retiring:
+            self.retiring = None
+        elif os.WIFSIGNALED(status) or os.WEXITSTATUS(status):
+            LOG.warning('Process {} crashed (status {}), replacing it.'.format(pid, status))
+            time.sleep(0.1)  # Don't fork as fast as possible if children keep crashing on startup.
+        else:
+            LOG.info('Process {} exited after {} requests, replacing it.'.format(pid, self.max_requests))
+
+    def _maintain(self):
+        """Forks missing children, and retires the next child of the old master if any."""
+        old = [p for p, current in self.children.items() if not current]
+        if self.retiring is None and old:
+            if len(self.children) - len(old) < self.processes:
+                self._fork()  # Replacement first, the old child stops accepting connections right away.
+            self.retiring = old[0]
+            self._kill(self.retiring)
+        while len(self.children) < self.processes:
+            self._fork()
+
+    @staticmethod
+    def _kill(pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def reload(self):
+        """Executes the command line again in this process, which keeps its PID, children, and listening sockets."""
+        LOG.info('Master {} reloading.'.format(os.getpid()))
+        for sock in self.sockets:
+            _clear_close_exec(sock.fileno())
+        os.environ[LISTEN_FDS] = ','.join('{}:{}'.format(s.fileno(), s.family) for s in self.sockets)
+        os.environ[RETIRE_PIDS] = ','.join(str(p) for p in self.children)
+        logging.shutdown()
+        os.execv(self.argv[0], self.argv)
+
+    def _fork(self):
+        """Forks a child. Never returns in the child."""
+        pid = os.fork()
+        if pid:
+            self.children[pid] = True
+            return
+        try:
+            self._serve()
+        except Exception:
+            LOG.exception('Process {} crashed.'.format(os.getpid()))
+            logging.shutdown()
+            os._exit(1)
+        logging.shutdown()
+        os._exit(0)
+
+    def _serve(self):
+        """Serves requests in a child until SIGTERM, SIGINT, or max_requests."""
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)  # Only for the master.
+        if self.on_child_start:
+            self.on_child_start()
+        io_loop = ioloop.IOLoop.instance()
+        server = _CountingHTTPServer(self.application)
+        server.add_sockets(self.sockets)
+        deadline = list()
+
+        def drain():
+            if server.busy and time.time() < deadline[0]:
+                io_loop.add_timeout(time.time() + 0.1, drain)
+            else:
+                io_loop.stop()
+
+        def stop():
+            if not deadline:
+                deadline.append(time.time() + self.graceful_timeout)
+                server.stop()  # Stop accepting connections, the other children take over.
+                drain()
+
+        def on_request():
+            if self.max_requests and server.requests >= self.max_requests:
+                io_loop.add_callback(stop)
+        server.on_request = on_request
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: io_loop.add_callback_from_signal(stop))
+        if self._signal == signal.SIGTERM:  # Received by the master's handler right after forking.
+            io_loop.add_callback(stop)
+        master = os.getppid()
+        ioloop.PeriodicCallback(lambda: os.getppid() == master or stop(), 1000, io_loop).start()  # Master was killed.
+        io_loop.start()
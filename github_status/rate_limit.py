@@ -0,0 +1,111 @@
+"""Keeps GitHub API calls within the rate limit quota of one or more API tokens.
+
+GitHub reports the remaining quota of the token used in every response's X-RateLimit-* headers. RateLimiter hands out
+tokens round-robin and counts down each token's remaining calls like a token bucket, refilled when GitHub resets the
+quota. When all buckets are empty callers wait for the earliest reset instead of getting HTTP 403 responses.
+"""
+
+import threading
+import time
+
+UNKNOWN_RESET_DELAY = 60  # Seconds until the reset of a used-up quota if GitHub's is missing or past (clock skew).
+
+
+class RateLimitError(Exception):
+    """Raised when no API token has quota left and the earliest reset is too far away to wait for."""
+
+    def __init__(self, reset):
+        super(RateLimitError, self).__init__('GitHub API rate limit exceeded, try again later.')
+        self.reset = reset
+
+
+class RateLimiter(object):
+    """Token bucket per GitHub API token.
+
+    Positional arguments:
+    tokens -- list of GitHub API tokens. An empty list means anonymous API calls (one bucket, no Authorization header).
+    max_wait -- seconds acquire() may wait for a quota reset before raising RateLimitError.
+    """
+
+    def __init__(self, tokens, max_wait):
+        self.max_wait = max_wait
+        self.buckets = [dict(token=t, limit=None, remaining=None, reset=0.0) for t in (tokens or [None])]
+        self._condition = threading.Condition()
+        self._next = 0
+
+    def _take(self, now):
+        """Reserves one call from the next bucket (round-robin) with quota left. Must be called with the lock held.
+
+        Returns:
+        The bucket dictionary or None if all buckets are empty.
+        """
+        for i in xrange(len(self.buckets)):
+            bucket = self.buckets[(self._next + i) % len(self.buckets)]
+            if bucket['reset'] <= now:
+                bucket['remaining'] = None  # Quota has been reset, exact number unknown until the next response.
+            if bucket['remaining'] is None or bucket['remaining'] > 0:
+                if bucket['remaining'] is not None:
+                    bucket['remaining'] -= 1
+                self._next = (self._next + i + 1) % len(self.buckets)
+                return bucket
+        return None
+
+    def acquire(self):
+        """Waits for quota and reserves one API call.
+
+        Raises:
+        RateLimitError -- raised if the earliest quota reset is more than max_wait seconds away.
+
+        Returns:
+        GitHub API token to use, None for anonymous calls.
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                bucket = self._take(now)
+                if bucket:
+                    return bucket['token']
+                reset = min(b['reset'] for b in self.buckets)
+                if reset - now > self.max_wait:
+                    raise RateLimitError(reset)
+                self._condition.wait(reset - now)
+
+    def wait(self):
+        """Blocks until at least one token has quota left, without reserving it. For background work that may wait for
+        as long as it takes instead of failing.
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                if any(b['reset'] <= now or b['remaining'] is None or b['remaining'] > 0 for b in self.buckets):
+                    return
+                self._condition.wait(min(b['reset'] for b in self.buckets) - now)
+
+    def update(self, token, headers):
+        """Records the quota reported by GitHub. Called after every response.
+
+        Positional arguments:
+        token -- the token returned by acquire() for this call.
+        headers -- response headers.
+        """
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        with self._condition:
+            bucket = [b for b in self.buckets if b['token'] == token][0]
+            bucket['limit'] = int(headers.get('X-RateLimit-Limit', 0)) or bucket['limit']
+            bucket['remaining'] = int(headers['X-RateLimit-Remaining'])
+            bucket['reset'] = float(headers.get('X-RateLimit-Reset', 0)) or bucket['reset']
+            if bucket['remaining'] == 0 and bucket['reset'] <= time.time():
+                bucket['reset'] = time.time() + UNKNOWN_RESET_DELAY  # Otherwise _take() would reset it right away.
+            self._condition.notify_all()
+
+    def budget(self):
+        """Returns the current quota of all tokens, without revealing the tokens themselves.
+
+        Returns:
+        List of dictionaries (limit, remaining, and reset as a UNIX timestamp), one per token. None means unknown.
+        """
+        with self._condition:
+            now = time.time()
+            return [dict(limit=b['limit'], remaining=b['remaining'] if b['reset'] > now else None,
+                         reset=b['reset'] if b['reset'] > now else None) for b in self.buckets]
@@ -0,0 +1,92 @@
+"""Refreshes every tracked repository in the background, stalest first. Run with `manage.py refresh`."""
+
+from logging import getLogger
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import time
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from github_status.extensions import db, github
+from github_status.models.repositories import Repository
+from github_status.views.api.query_github import APIError, fetch_and_save, resume_jobs
+
+LOG = getLogger(__name__)
+
+
+def refresh_repo(repo_url):
+    """Fetches and saves one repository's metadata. Errors are logged instead of raised.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    True on success, False on error.
+    """
+    try:
+        fetch_and_save(repo_url, add_repo=False)
+    except (APIError, TimeoutError) as e:
+        LOG.warning('Failed to refresh {}: {}'.format(repo_url, str(e) or e.__class__.__name__))
+        db.session.rollback()
+        return False
+    except SQLAlchemyError:
+        LOG.exception('Failed to refresh {}, database error.'.format(repo_url))
+        db.session.rollback()
+        return False
+    return True
+
+
+def refresh_all(batch_size, concurrency):
+    """Refreshes all tracked repositories once, in batches, stalest first (never refreshed ones before all others).
+
+    Uses its own thread pool since fetch_metadata() itself runs on the `workers` pool. Waits for the GitHub API quota to
+    reset when it runs out. Also resumes line count jobs left pending by processes which exited (see resume_jobs()).
+
+    Positional arguments:
+    batch_size -- number of repositories to refresh before moving on to the next batch.
+    concurrency -- number of repositories to refresh at the same time.
+
+    Returns:
+    Tuple of two integers, number of repositories refreshed and number of failures.
+    """
+    app = current_app._get_current_object()
+    resume_jobs()
+    query = db.session.query(Repository.url).order_by(Repository.last_refreshed)  # NULLs sort first in MySQL/SQLite.
+    repo_urls = [r[0] for r in query]
+    db.session.remove()  # Don't hold on to a connection between batches.
+
+    def run(repo_url):
+        with app.app_context():
+            return refresh_repo(repo_url)
+
+    pool = ThreadPool(concurrency)
+    successes, failures = 0, 0
+    try:
+        for i in xrange(0, len(repo_urls), batch_size):
+            batch = repo_urls[i:i + batch_size]
+            github.limiter.wait()  # Defer the batch until the API quota resets instead of failing it.
+            results = pool.map(run, batch)
+            successes += results.count(True)
+            failures += results.count(False)
+            LOG.info('Refreshed {} of {} repositories.'.format(i + len(batch), len(repo_urls)))
+    finally:
+        pool.close()
+        pool.join()
+    return successes, failures
+
+
+def run_forever(batch_size, concurrency, interval):
+    """Calls refresh_all() in a loop. Each pass starts at least `interval` seconds after the previous one started.
+
+    Positional arguments:
+    batch_size -- passed to refresh_all().
+    concurrency -- passed to refresh_all().
+    interval -- seconds between passes.
+    """
+    while True:
+        start = time.time()
+        successes, failures = refresh_all(batch_size, concurrency)
+        LOG.info('Pass done in {:.1f} seconds, {} refreshed, {} failed.'.format(time.time() - start, successes,
+                                                                                failures))
+        time.sleep(max(interval - (time.time() - start), 0))
@@ -0,0 +1,48 @@
+"""Coalesces concurrent calls of the same function (identified by a key) within a process.
+
+The first caller runs the function. Callers arriving with the same key before it returns wait for it and get the same
+return value (or exception) instead of running the function themselves.
+"""
+
+import threading
+
+
+class SingleFlight(object):
+    """Tracks in-flight calls by key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+
+    def do(self, key, func, *args, **kwargs):
+        """Calls func(*args, **kwargs) unless a call with the same key is already in flight, then waits for that one.
+
+        Positional arguments:
+        key -- hashable key identifying duplicate calls.
+        func -- the function to call. Remaining arguments are passed to it.
+
+        Returns:
+        The return value of func. Exceptions raised by it are raised to all callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = dict(done=threading.Event(), result=None, error=None)
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func(*args, **kwargs)
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
@@ -0,0 +1,165 @@
+"""Static file pipeline: content-hashed copies, precompressed variants, and a Tornado handler serving them.
+
+`manage.py build_static` copies every file in the static folder to STATIC_BUILD_FOLDER twice: under its own name and
+under a name including a hash of its content (e.g. bootstrap/css/bootstrap.min.3f1c0a9be2d4.css). Compressible files
+also get a gzipped .gz variant next to each copy. manifest.json maps original names to hashed ones.
+
+Templates link to hashed names through static_url() (see github_status.extensions.StaticFiles). Their content never
+changes, so browsers cache them forever and never revalidate. A new build yields new names, older ones are kept for
+pages still referencing them.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+from tornado import web
+
+COMPRESSIBLE = ('.css', '.eot', '.html', '.ico', '.js', '.json', '.map', '.otf', '.svg', '.ttf', '.txt')
+HASH_LENGTH = 12
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # One year, the maximum recommended by RFC 2616.
+MANIFEST = 'manifest.json'
+CSS_URL = re.compile(r'''url\((['"]?)([^'"()]+)\1\)''')
+
+
+def hashed_name(name, content):
+    """Inserts a hash of the content into a file name, before its extension.
+
+    Positional arguments:
+    name -- file name or path (e.g. css/bootstrap.min.css).
+    content -- the file's content.
+
+    Returns:
+    File name or path with the hash (e.g. css/bootstrap.min.3f1c0a9be2d4.css).
+    """
+    root, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(root, hashlib.md5(content).hexdigest()[:HASH_LENGTH], ext)
+
+
+def rewrite_css(name, content, manifest):
+    """Points url() references of a stylesheet to the hashed names of the referenced files.
+
+    Positional arguments:
+    name -- path of the stylesheet relative to the static folder, with forward slashes.
+    content -- the stylesheet.
+    manifest -- dictionary of original names to hashed names built so far.
+
+    Returns:
+    The rewritten stylesheet.
+    """
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        quote, url = match.groups()
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()  # Keep query strings and fragments (IE font hacks).
+        if not path or ':' in path or path.startswith('/'):
+            return match.group(0)  # data: URIs, absolute URLs.
+        target = manifest.get(posixpath.normpath(posixpath.join(directory, path)))
+        if target is None:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(target, directory or '.'), suffix)
+    return CSS_URL.sub(replace, content)
+
+
+def _write(path, content):
+    """Writes a file and its gzipped variant if it's compressible and it's smaller."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(content)
+    if not path.lower().endswith(COMPRESSIBLE):
+        return
+    with open(path + '.gz', 'wb') as f:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=9, mtime=0) as gz:  # mtime: reproducible.
+            gz.write(content)
+    if os.path.getsize(path + '.gz') >= len(content):
+        os.remove(path + '.gz')
+
+
+def build(source, destination):
+    """Writes original and content-hashed copies of all static files, their gzipped variants, and the manifest.
+
+    Positional arguments:
+    source -- the static folder.
+    destination -- folder to write to. Created if it doesn't exist. Files of previous builds are kept.
+
+    Returns:
+    The manifest, a dictionary of original names to hashed names (paths relative to the folders, forward slashes).
+    """
+    names = list()
+    for directory, _, files in os.walk(source):
+        for file_name in files:
+            path = os.path.relpath(os.path.join(directory, file_name), source)
+            names.append(path.replace(os.path.sep, '/'))
+
+    # Stylesheets last, they reference the hashed names of fonts and images.
+    manifest = dict()
+    for name in sorted(names, key=lambda n: (n.lower().endswith('.css'), n)):
+        with open(os.path.join(source, name), 'rb') as f:
+            content = f.read()
+        if name.lower().endswith('.css'):
+            content = rewrite_css(name, content, manifest)
+        manifest[name] = hashed_name(name, content)
+        _write(os.path.join(destination, name), content)
+        _write(os.path.join(destination, manifest[name]), content)
+
+    # Replace the manifest atomically, running processes may read it any time.
+    temp_path = os.path.join(destination, MANIFEST + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(temp_path, os.path.join(destination, MANIFEST))
+    return manifest
+
+
+def load_manifest(folder):
+    """Reads the manifest written by build().
+
+    Positional arguments:
+    folder -- the destination folder passed to build(), may be None.
+
+    Returns:
+    The manifest, or None if the folder has none.
+    """
+    if not folder or not os.path.isfile(os.path.join(folder, MANIFEST)):
+        return None
+    with open(os.path.join(folder, MANIFEST)) as f:
+        return json.load(f)
+
+
+class StaticFileHandler(web.StaticFileHandler):
+    """Tornado StaticFileHandler for folders written by build().
+
+    Clients accepting gzip get the .gz variant if there is one, with Content-Encoding set. Hashed files are cached by
+    clients for a year without revalidation.
+
+    Keyword arguments (passed through the Tornado URL spec):
+    path -- the folder to serve.
+    default_filename -- same as Tornado's StaticFileHandler.
+    manifest -- dictionary returned by build(), None if the folder isn't a build.
+    """
+
+    def initialize(self, path, default_filename=None, manifest=None):
+        super(StaticFileHandler, self).initialize(path, default_filename)
+        self.immutable = set((manifest or dict()).values())
+        self.gzipped = False
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(root, absolute_path)
+        if absolute_path and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.gzipped = os.path.isfile(absolute_path + '.gz')
+        return absolute_path + '.gz' if self.gzipped else absolute_path
+
+    def set_extra_headers(self, path):
+        if path.lower().endswith(COMPRESSIBLE):
+            self.set_header('Vary', 'Accept-Encoding')
+        if self.gzipped:
+            self.set_header('Content-Encoding', 'gzip')
+        if path in self.immutable:
+            self.set_header('Cache-Control', 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE))
+
+    def get_cache_time(self, path, modified, mime_type):
+        return IMMUTABLE_MAX_AGE if path in self.immutable else 0
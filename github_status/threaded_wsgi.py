@@ -0,0 +1,134 @@
+"""Runs Flask requests of prodserver in a bounded thread pool instead of inside Tornado's IOLoop.
+
+tornado.wsgi.WSGIContainer calls the WSGI application synchronously in the IOLoop, so while a view waits on MySQL or
+GitHub the process can't accept connections or serve static files. ThreadedWSGIContainer calls it in a thread and writes
+the response from the IOLoop once it's ready. Requests beyond the busy threads and a bounded queue get HTTP 503 right
+away instead of piling up.
+"""
+
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+from tornado import httputil
+from tornado.ioloop import IOLoop
+from tornado.wsgi import WSGIContainer
+
+LOG = getLogger(__name__)
+ENVIRON_KEY = 'github_status.threaded_wsgi'  # WSGI environ key holding the ThreadedWSGIContainer, for its metrics.
+
+
+class _IOLoopRequest(object):
+    """Proxy of a Tornado HTTPServerRequest which writes to the connection from the IOLoop. Tornado isn't thread-safe.
+
+    Positional arguments:
+    request -- tornado.httputil.HTTPServerRequest instance.
+    io_loop -- IOLoop serving the request.
+    """
+
+    def __init__(self, request, io_loop):
+        self._request = request
+        self._io_loop = io_loop
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+    def write(self, chunk, callback=None):
+        self._io_loop.add_callback(self._request.write, chunk, callback)
+
+    def finish(self):
+        self._io_loop.add_callback(self._request.finish)
+
+
+class ThreadedWSGIContainer(WSGIContainer):
+    """WSGIContainer which calls the WSGI application in a thread pool, with admission control and queue metrics.
+
+    Like github_status.extensions.Workers the pool is created lazily, so every prodserver child has its own.
+
+    Positional arguments:
+    wsgi_application -- WSGI application (e.g. the Flask application).
+    threads -- number of threads per process.
+    max_queue -- number of requests which may wait for a free thread. More get HTTP 503.
+    """
+
+    def __init__(self, wsgi_application, threads, max_queue):
+        def application(environ, start_response):
+            environ['wsgi.multithread'] = True
+            environ[ENVIRON_KEY] = self
+            return wsgi_application(environ, start_response)
+        super(ThreadedWSGIContainer, self).__init__(application)
+        self.threads = threads
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._pending = 0  # Queued plus running requests.
+        self._running = 0
+        self._counters = dict(requests=0, rejected=0, errors=0, wait_seconds=0.0, max_wait_seconds=0.0)
+
+    @property
+    def pool(self):
+        """The ThreadPool instance belonging to the current process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ThreadPool(self.threads)
+                self._pid = os.getpid()
+                self._pending = self._running = 0
+        return self._pool
+
+    def stats(self):
+        """Returns this process' metrics.
+
+        Returns:
+        Dictionary of pool settings, current queue depth and running requests, and counters since the process started.
+        wait_seconds is the time requests spent in the queue.
+        """
+        with self._lock:
+            stats = dict(self._counters, threads=self.threads, max_queue=self.max_queue, running=self._running)
+            stats['queue_depth'] = self._pending - self._running
+        return stats
+
+    def __call__(self, request):
+        pool = self.pool
+        with self._lock:
+            rejected = self._pending >= self.threads + self.max_queue
+            if rejected:
+                self._counters['rejected'] += 1
+            else:
+                self._pending += 1
+        if rejected:
+            self._respond(request, 503)
+            return
+        pool.apply_async(self._run, (request, IOLoop.current(), time.time()))
+
+    def _run(self, request, io_loop, queued):
+        """Calls the WSGI application in a pool thread."""
+        waited = time.time() - queued
+        with self._lock:
+            self._running += 1
+            self._counters['requests'] += 1
+            self._counters['wait_seconds'] += waited
+            self._counters['max_wait_seconds'] = max(self._counters['max_wait_seconds'], waited)
+        try:
+            super(ThreadedWSGIContainer, self).__call__(_IOLoopRequest(request, io_loop))
+        except Exception:
+            LOG.exception('WSGI application raised an exception.')
+            with self._lock:
+                self._counters['errors'] += 1
+            io_loop.add_callback(self._respond, request, 500)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+
+    def _respond(self, request, status_code):
+        """Writes an empty response without calling the WSGI application. Must be called from the IOLoop."""
+        headers = ['Content-Length: 0']
+        if status_code == 503:
+            headers.append('Retry-After: 1')
+        request.write(b'HTTP/1.1 {} {}\r\n{}\r\n\r\n'.format(status_code, httputil.responses[status_code],
+                                                             '\r\n'.join(headers)))
+        request.finish()
+        self._log(status_code, request)
@@ -1,8 +1,34 @@
-from flask import Response
+from flask import jsonify, request, Response
 
 from github_status.blueprints import api_health
+from github_status.extensions import db
+from github_status.threaded_wsgi import ENVIRON_KEY
 
 
 @api_health.route('/', strict_slashes=False)
 def index():
     return Response('Running', content_type='text/plain;charset=UTF-8')
+
+
+@api_health.route('/db_pool')
+def db_pool():
+    """Reports this process' database connection pool metrics.
+
+    Returns:
+    JSON encoded pool class name, plus github_status.pool.MeteredQueuePool.stats() if the pool keeps metrics (MySQL).
+    """
+    pool = db.engine.pool
+    stats = pool.stats() if hasattr(pool, 'stats') else dict()
+    return jsonify(pool=pool.__class__.__name__, **stats)
+
+
+@api_health.route('/wsgi_threads')
+def wsgi_threads():
+    """Reports this process' request queue metrics when prodserver runs with --workers_threads.
+
+    Returns:
+    JSON encoded enabled boolean, plus github_status.threaded_wsgi.ThreadedWSGIContainer.stats() if enabled.
+    """
+    container = request.environ.get(ENVIRON_KEY)
+    stats = container.stats() if container else dict()
+    return jsonify(enabled=container is not None, **stats)
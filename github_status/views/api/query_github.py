@@ -1,15 +1,30 @@
+from collections import Counter
+from datetime import datetime, timedelta
+import heapq
+import itertools
+from logging import getLogger
+from multiprocessing import TimeoutError
 import string
-import time
+from urlparse import parse_qs, urlparse
 
-from flask import abort, jsonify, request
+from flask import abort, current_app, jsonify, request, Response, stream_with_context
 import json
-import requests
+from requests import RequestException
+from sqlalchemy import bindparam, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from github_status.blueprints import api_query_github
-from github_status.extensions import db
-from github_status.models.helpers import count
-from github_status.models.repositories import Repository
+from github_status.extensions import db, github, page_cache, page_workers, workers
+from github_status.models.helpers import advisory_lock, bump_version, exists, upsert
+from github_status.models.jobs import Job
+from github_status.models.repositories import Repository, summarize
+from github_status.rate_limit import RateLimitError
+from github_status.single_flight import SingleFlight
 
+IN_FLIGHT = SingleFlight()
+LOG = getLogger(__name__)
+LINE_COUNT_COLUMNS = ('line_count', 'line_count_week', 'line_count_totals')
+SECONDS_PER_WEEK = 7 * 24 * 60 * 60
 VALID_CHARACTERS = string.ascii_letters + string.digits + '/_-'
 
 
@@ -17,78 +32,512 @@ class APIError(Exception):
     pass
 
 
-def get_committers_details(repo_url):
-    """Queries GitHub API for the last commit message and the top 3 committers (within 50 most recent commits).
+class StatsPendingError(APIError):
+    """Raised when GitHub responds with HTTP 202, meaning it's still generating the requested statistics."""
+    pass
+
+
+def _decode(response):
+    """Validates a GitHub API response and decodes its JSON body.
 
     Raises:
     APIError -- raised on handled API errors.
 
     Positional arguments:
-    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+    response -- requests.Response instance.
 
     Returns:
-    Tuple, first item is a set of top 3 committers, second item is a string of the latest commit message.
+    Decoded JSON data, never empty.
     """
-    # Query API.
-    req = requests.get('https://api.github.com/repos/{}/commits'.format(repo_url))
-    if not req.ok:
+    if not response.ok:
         raise APIError('Invalid GitHub URL specified.')
     try:
-        json_data = json.loads(req.text)
+        json_data = json.loads(response.text)
     except ValueError:
         raise APIError('GitHub responded with invalid JSON.')
     if not json_data:
         raise APIError('GitHub responded with empty JSON.')
+    return json_data
+
+
+def iter_json_array(chunks):
+    """Incrementally decodes a JSON array, yielding one item at a time without holding the whole document in memory.
+
+    Items must be objects or arrays (they're decoded once their closing bracket arrives). For compatibility a document
+    which isn't an array is decoded whole; empty ones (e.g. {}) yield nothing.
 
-    # Get last commit details and top 3 committers.
-    last_commit_message = json_data[0].get('commit', {}).get('message', '')
-    last_fifty = [a for a in ((c.get('author', {}) or {}).get('login', '') for c in json_data[:50]) if a]
-    top_three = set()
-    for author in sorted(last_fifty, key=last_fifty.count, reverse=True):
-        top_three.add(author)
-        if len(top_three) >= 3:
+    Raises:
+    ValueError -- raised on invalid JSON.
+
+    Positional arguments:
+    chunks -- iterable of strings, consecutive pieces of the JSON document.
+
+    Yields:
+    Each decoded item of the array.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        if buf.lstrip():
             break
-    return top_three, last_commit_message
+    buf = buf.lstrip()
+    if not buf.startswith('['):
+        document = json.loads(buf + ''.join(chunks))
+        if document:
+            raise ValueError('Expected a JSON array.')
+        return
+    buf, expect_item = buf[1:], True
+    for chunk in itertools.chain([''], chunks):
+        buf += chunk
+        while True:
+            buf = buf.lstrip()
+            if buf.startswith(']'):
+                return
+            if not expect_item:
+                if not buf:
+                    break
+                if not buf.startswith(','):
+                    raise ValueError('Expected a comma.')
+                buf, expect_item = buf[1:], True
+                continue
+            if not buf:
+                break
+            try:
+                item, end = decoder.raw_decode(buf)
+            except ValueError:
+                break  # Item incomplete, wait for more data.
+            yield item
+            buf, expect_item = buf[end:], False
+    raise ValueError('Unexpected end of JSON data.')
 
 
-def get_line_count(repo_url):
-    """Queries GitHub API for the entire repo's code base line count.
+def _parse_commits_page(response):
+    """Parses one page of the /commits API, streaming its body through iter_json_array().
 
     Raises:
     APIError -- raised on handled API errors.
 
     Positional arguments:
-    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+    response -- requests.Response instance, requested with stream=True.
 
     Returns:
-    Integer representing the total line count.
+    Tuple: list of commit author logins (empty strings if not GitHub users), the first commit's message (None if the
+        page is empty), and the number of the last page (1 if there are no other pages).
     """
-    # Query API. GitHub API docs state HTTP202 may be returned if data is not generated yet. Retries up to 3 seconds.
-    req = None
-    for i in xrange(3):
-        if i:
-            time.sleep(1)  # Sleep on second and third iterations.
-        req = requests.get('https://api.github.com/repos/{}/stats/contributors'.format(repo_url))
-        if req.status_code == 202:
-            continue
-        if not req.ok:
-            raise APIError('Invalid GitHub URL specified.')
-        break
-    if req.status_code == 202:
-        raise APIError('GitHub still generating data, try again later.')
+    if not response.ok:
+        raise APIError('Invalid GitHub URL specified.')
+    authors, first_commit_message = list(), None
     try:
-        json_data = json.loads(req.text)
+        for commit in iter_json_array(response.iter_content(65536, decode_unicode=True)):
+            if first_commit_message is None:
+                first_commit_message = commit.get('commit', {}).get('message', '')
+            authors.append((commit.get('author', {}) or {}).get('login', ''))
     except ValueError:
         raise APIError('GitHub responded with invalid JSON.')
-    if not json_data:
+    last_url = response.links.get('last', {}).get('url', '')
+    last_page = int(parse_qs(urlparse(last_url).query).get('page', ['1'])[0])
+    return authors, first_commit_message, last_page
+
+
+def rank_committers(authors, top):
+    """Ranks committers by their number of commits in O(n log k) time.
+
+    Ties are broken by the most recent commit, so the order is deterministic.
+
+    Positional arguments:
+    authors -- list of commit author logins, most recent commit first. Empty strings (non-GitHub users) are ignored.
+    top -- number of committers to return (k).
+
+    Returns:
+    List of the top committers' logins, most commits first.
+    """
+    counts, first_seen = Counter(), dict()
+    for i, author in enumerate(authors):
+        if author:
+            counts[author] += 1
+            first_seen.setdefault(author, i)
+    return heapq.nsmallest(top, counts, key=lambda a: (-counts[a], first_seen[a]))
+
+
+def fold_line_count(contributors, week, totals):
+    """Sums up additions minus deletions of every contributor's weekly stats, incrementally.
+
+    Weeks up to and including `week` were summed up into `totals` by a previous call, so for known contributors only
+    newer weeks are looked at (weeks are in chronological order). Contributors missing from `totals` (new ones, and ones
+    without a GitHub account) are summed up from scratch. The most recent week may still change so it's never folded
+    into the new totals.
+
+    Positional arguments:
+    contributors -- decoded JSON data from the /stats/contributors API.
+    week -- UNIX timestamp of the last week summed up in `totals`, None to start from scratch.
+    totals -- dictionary of contributor logins and their line counts up to `week`.
+
+    Returns:
+    Tuple: the total line count, the new `week`, and the new `totals` to pass next time.
+    """
+    latest = max([c['weeks'][-1].get('w', 0) for c in contributors if c.get('weeks')] or [0])
+    new_week = latest - SECONDS_PER_WEEK
+    if week is None or new_week < week:
+        week, totals = None, dict()  # No previous state or GitHub's data went back in time, start from scratch.
+
+    line_count, new_totals = 0, dict()
+    for contributor in contributors:
+        login = (contributor.get('author', {}) or {}).get('login', '')
+        known = week is not None and login in totals
+        total, recent = totals[login] if known else 0, 0
+        for stats in reversed(contributor.get('weeks', [])):
+            if known and stats.get('w', 0) <= week:
+                break
+            if stats.get('w', 0) <= new_week:
+                total += stats.get('a', 0) - stats.get('d', 0)
+            else:
+                recent += stats.get('a', 0) - stats.get('d', 0)
+        if login:
+            new_totals[login] = total
+        line_count += total + recent
+    return line_count, new_week, new_totals
+
+
+def _parse_contributors(response, state):
+    """Parses the response of the /stats/contributors API. Returns the same as get_line_stats()."""
+    if response.status_code == 202:
+        raise StatsPendingError('GitHub still generating data, try again later.')
+    json_data = _decode(response)
+    if state and state['line_count_totals']:
+        week, totals = state['line_count_week'], json.loads(state['line_count_totals'])
+    else:
+        week, totals = None, dict()
+    line_count, week, totals = fold_line_count(json_data, week, totals)
+    return dict(line_count=line_count, line_count_week=week, line_count_totals=json.dumps(totals, sort_keys=True))
+
+
+def load_line_count_state(repo_url):
+    """Reads the line count state of a repo previously saved by get_line_stats().
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    Dictionary with line_count_week and line_count_totals, None if the repo isn't tracked.
+    """
+    columns = (Repository.line_count_week, Repository.line_count_totals)
+    row = db.session.query(*columns).filter_by(url_lower=repo_url.lower()).first()
+    return dict(line_count_week=row[0], line_count_totals=row[1]) if row else None
+
+
+def _get_commits_page(url):
+    """Queries one page of the /commits API through the cache. Returns the same as _parse_commits_page()."""
+    try:
+        return github.get_cached(url, _parse_commits_page, stream=True)
+    except RequestException:
+        raise APIError('Unable to reach GitHub, try again later.')
+    except RateLimitError as e:
+        raise APIError(str(e))
+
+
+def get_committers_details(repo_url):
+    """Queries GitHub API for the last commit message and the top GITHUB_TOP_COMMITTERS committers (within the
+    GITHUB_COMMITS_WINDOW most recent commits).
+
+    Walks the API's pagination if the window spans more than one page (100 commits). The first page tells how many
+    pages there are, the rest are then fetched concurrently.
+
+    Raises:
+    APIError -- raised on handled API errors.
+    multiprocessing.TimeoutError -- raised if pages take longer than GITHUB_QUERY_TIMEOUT seconds.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    Tuple, first item is a list of top committers (see rank_committers()), second item is a string of the latest commit
+        message.
+    """
+    window = current_app.config['GITHUB_COMMITS_WINDOW']
+    per_page = min(window, 100)  # GitHub's maximum.
+    url = 'https://api.github.com/repos/{}/commits?per_page={}&page={{}}'.format(repo_url, per_page)
+
+    authors, last_commit_message, last_page = _get_commits_page(url.format(1))
+    if last_commit_message is None:
         raise APIError('GitHub responded with empty JSON.')
+    pages = min(last_page, -(-window // per_page))
+    results = [page_workers.submit(_get_commits_page, url.format(p)) for p in xrange(2, pages + 1)]
+    for more_authors, _, _ in page_workers.wait_all(results, current_app.config['GITHUB_QUERY_TIMEOUT']):
+        authors.extend(more_authors)
+
+    return rank_committers(authors[:window], current_app.config['GITHUB_TOP_COMMITTERS']), last_commit_message
+
+
+def get_line_stats(repo_url, state):
+    """Queries GitHub API for the entire repo's code base line count, only summing up weeks newer than the saved state.
+
+    Raises:
+    APIError -- raised on handled API errors.
+    StatsPendingError -- GitHub API docs state HTTP202 may be returned if data is not generated yet. Never retried here,
+        see finish_job().
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+    state -- dictionary returned by load_line_count_state(), None to start from scratch.
+
+    Returns:
+    Dictionary of the Repository columns in LINE_COUNT_COLUMNS: the total line count and the new state.
+    """
+    try:
+        return github.get_cached('https://api.github.com/repos/{}/stats/contributors'.format(repo_url),
+                                 lambda response: _parse_contributors(response, state))
+    except RequestException:
+        raise APIError('Unable to reach GitHub, try again later.')
+    except RateLimitError as e:
+        raise APIError(str(e))
+
+
+def get_line_count(repo_url):
+    """Queries GitHub API for the entire repo's code base line count. Same as get_line_stats(), from scratch.
+
+    Returns:
+    Integer representing the total line count.
+    """
+    return get_line_stats(repo_url, None)['line_count']
+
+
+def start_job(repo_url):
+    """Creates a job to fetch the repo's line count in the background. Schedules its first attempt.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    The new Job's ID.
+    """
+    job = Job(repo_url=repo_url)
+    db.session.add(job)
+    db.session.commit()
+    workers.submit_later(current_app.config['GITHUB_STATS_BACKOFF'], finish_job, job.id)
+    return job.id
+
+
+def finish_job(job_id):
+    """Background task which fetches the repo's line count and saves it to the Repository row.
+
+    Reschedules itself with exponential backoff while GitHub is still generating data, up to GITHUB_STATS_RETRIES times.
+    Unexpected errors (e.g. database errors) are logged and fail the job, so it never stays pending forever.
+
+    Positional arguments:
+    job_id -- ID of the Job to work on.
+    """
+    job = Job.query.get(job_id)
+    if job is None:
+        LOG.warning('Job {} not found, it was deleted.'.format(job_id))
+        return
+    if job.status != 'pending':
+        return  # Resumed by resume_jobs() in another process, which finished it first.
+    repo_url = job.repo_url
+    try:
+        _finish_job(job)
+    except Exception:
+        LOG.exception('Job {} for {} failed.'.format(job_id, repo_url))
+        db.session.rollback()
+        db.session.query(Job).filter_by(id=job_id).update(dict(
+            status='failed', error='Unexpected error, try again later.', attempts=Job.attempts + 1
+        ))
+        db.session.commit()
+
+
+def resume_jobs():
+    """Schedules pending jobs whose next attempt is overdue, e.g. because the process which started them exited
+    (`manage.py refresh` finished, or a prodserver child was replaced or crashed). Retries are timers which only live
+    in their process, the Job rows are what survives.
+
+    A job is overdue GITHUB_STATS_ORPHAN_DELAY seconds after its next attempt was due (see _finish_job()). It's claimed
+    by setting its updated column if it didn't change since it was read, so it's resumed by one process only.
+
+    Returns:
+    List of the resumed Job IDs.
+    """
+    backoff, grace = current_app.config['GITHUB_STATS_BACKOFF'], current_app.config['GITHUB_STATS_ORPHAN_DELAY']
+    now = datetime.utcnow()
+    query = db.session.query(Job.id, Job.attempts, Job.updated).filter(
+        Job.status == 'pending', Job.updated < now - timedelta(seconds=backoff + grace))
+    resumed = list()
+    for job_id, attempts, updated in query.all():
+        if updated + timedelta(seconds=backoff * 2 ** attempts + grace) > now:
+            continue
+        claim = db.session.query(Job).filter_by(id=job_id, status='pending', updated=updated)
+        if claim.update(dict(updated=now), synchronize_session=False):
+            resumed.append(job_id)
+    db.session.commit()
+    for job_id in resumed:
+        LOG.info('Resuming job {}.'.format(job_id))
+        workers.submit_later(0, finish_job, job_id)  # Counted by Workers.wait_scheduled().
+    return resumed
+
+
+def resume_jobs_forever():
+    """Calls resume_jobs() now and then every GITHUB_STATS_ORPHAN_DELAY seconds, in the `workers` pool."""
+    try:
+        resume_jobs()
+    except Exception:
+        LOG.exception('Failed to resume jobs.')
+        db.session.rollback()
+    finally:
+        workers.submit_later(current_app.config['GITHUB_STATS_ORPHAN_DELAY'], resume_jobs_forever)
 
-    line_count = 0
-    for contributor in json_data:
-        for week in contributor.get('weeks', []):
-            line_count += week.get('a', 0)
-            line_count += -1 * week.get('d', 0)
-    return line_count
+
+def _finish_job(job):
+    """Makes one attempt of finish_job() and commits."""
+    job.attempts += 1
+    try:
+        line_stats = get_line_stats(job.repo_url, load_line_count_state(job.repo_url))
+    except StatsPendingError as e:
+        if job.attempts > current_app.config['GITHUB_STATS_RETRIES']:
+            job.status, job.error = 'failed', str(e)
+        else:
+            delay = current_app.config['GITHUB_STATS_BACKOFF'] * 2 ** job.attempts
+            workers.submit_later(delay, finish_job, job.id)
+    except APIError as e:
+        job.status, job.error = 'failed', str(e)
+    else:
+        # Also the version of HTTP validators (see repository_version()).
+        line_stats = dict(line_stats, last_refreshed=datetime.utcnow(), writes=func.coalesce(Repository.writes, 0) + 1)
+        query = db.session.query(Repository).filter_by(url_lower=job.repo_url.lower())
+        query.update(line_stats, synchronize_session=False)  # SQL expression, can't be evaluated in Python.
+        bump_version(Repository)
+        job.status = 'done'
+    db.session.commit()
+    if job.status == 'done':
+        page_cache.invalidate(job.repo_url)
+
+
+def fetch_metadata(repo_url):
+    """Queries GitHub's API for all of the repo's metadata. Both API calls run concurrently.
+
+    Raises:
+    APIError -- raised on handled API errors.
+    multiprocessing.TimeoutError -- raised if GitHub takes longer than GITHUB_QUERY_TIMEOUT seconds.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    Dictionary of Repository column values. line_count is None if GitHub is still generating it.
+    """
+    state = load_line_count_state(repo_url)
+    results = [workers.submit(get_committers_details, repo_url), workers.submit(get_line_stats, repo_url, state)]
+    timeout = current_app.config['GITHUB_QUERY_TIMEOUT']
+    try:
+        (top_committers, last_commit_message), line_stats = workers.wait_all(results, timeout)
+    except StatsPendingError:
+        # Line count fetched in the background.
+        (top_committers, last_commit_message), line_stats = results[0].get(), None
+    return _payload(repo_url, line_stats, top_committers, last_commit_message)
+
+
+def _payload(repo_url, line_stats, top_committers, last_commit_message):
+    """Returns the Repository column values from the results of get_line_stats() and get_committers_details()."""
+    payload = dict(url=repo_url, top_committers=' '.join(top_committers), last_commit=last_commit_message,
+                   last_commit_summary=summarize(last_commit_message))
+    payload.update(line_stats or dict((c, None) for c in LINE_COUNT_COLUMNS))
+    return payload
+
+
+def _row_values(payload, add_repo, now):
+    """Returns the Repository column values to write for a fetch_metadata() dictionary."""
+    values = dict(payload, url_lower=payload['url'].lower(), last_refreshed=now)
+    if not add_repo and values['line_count'] is None:
+        for column in LINE_COUNT_COLUMNS:
+            values.pop(column)  # Keep the previous line count until the job finishes.
+    return values
+
+
+def _save_error(add_repo):
+    """Returns the error message of a row which wasn't written because it was added (or removed) concurrently."""
+    if add_repo:
+        return 'Repository already tracked, cannot add.'
+    return 'Repository not being tracked, cannot update.'
+
+
+def save_metadata(payload, add_repo):
+    """Adds or updates a Repository row and commits. Starts a background job if the line count is missing.
+
+    Positional arguments:
+    payload -- dictionary returned by fetch_metadata().
+    add_repo -- inserts a new row if True, otherwise updates an existing one.
+
+    Raises:
+    APIError -- raised if the repo was added (or removed) by someone else since query() checked.
+
+    Returns:
+    The background job's ID, or None if there is no job.
+    """
+    payload = _row_values(payload, add_repo, datetime.utcnow())
+    if not upsert(Repository, payload, 'url_lower', insert=add_repo, update=not add_repo, counter='writes'):
+        db.session.rollback()
+        raise APIError(_save_error(add_repo))
+    bump_version(Repository)
+    db.session.commit()
+    page_cache.invalidate(payload['url'])
+    if payload.get('line_count', None) is None:
+        return start_job(payload['url'])
+    return None
+
+
+def validate_repo_url(repo_url):
+    """Verifies a repo URL submitted by a user.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+
+    Returns:
+    Error message string, or None if the URL is valid.
+    """
+    if repo_url.count('/') != 1:
+        return 'Invalid GitHub URL, must have only one slash.'
+    for letter in repo_url:
+        if letter not in VALID_CHARACTERS:
+            return 'Invalid GitHub URL, invalid character(s) found.'
+    return None
+
+
+def _fetch_and_save_locked(repo_url, add_repo):
+    """Calls fetch_metadata() and save_metadata() while holding a database lock for the repo, shared by all processes.
+
+    If another process refreshed the repo while this one waited for the lock, its result is reused. If another process
+    added it, this add fails the same way save_metadata() does.
+    """
+    started = datetime.utcnow().replace(microsecond=0)  # MySQL DATETIME columns drop microseconds.
+    with advisory_lock(repo_url.lower(), current_app.config['GITHUB_QUERY_TIMEOUT']):
+        db.session.rollback()  # Start a new transaction so commits by other processes are visible.
+        row = db.session.query(Repository.last_refreshed).filter_by(url_lower=repo_url.lower()).first()
+        if row and add_repo:
+            raise APIError('Repository already tracked, cannot add.')
+        if row and row.last_refreshed and row.last_refreshed >= started:
+            return None
+        return save_metadata(fetch_metadata(repo_url), add_repo)
+
+
+def fetch_and_save(repo_url, add_repo):
+    """Fetches and saves the repo's metadata, coalescing concurrent calls for the same repo.
+
+    Within a process only the first caller queries GitHub, the others wait for it and share its result. If
+    SINGLE_FLIGHT_DB_LOCK is enabled this extends to all processes through a database lock.
+
+    Raises:
+    APIError -- raised on handled API errors.
+    multiprocessing.TimeoutError -- raised if GitHub takes longer than GITHUB_QUERY_TIMEOUT seconds.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+    add_repo -- passed to save_metadata().
+
+    Returns:
+    The background job's ID, or None if there is no job.
+    """
+    if current_app.config['SINGLE_FLIGHT_DB_LOCK']:
+        return IN_FLIGHT.do((repo_url.lower(), add_repo), _fetch_and_save_locked, repo_url, add_repo)
+    return IN_FLIGHT.do((repo_url.lower(), add_repo), lambda: save_metadata(fetch_metadata(repo_url), add_repo))
 
 
 @api_query_github.route('/update', defaults=dict(add_repo=False), strict_slashes=False, methods=('POST',))
@@ -102,36 +551,235 @@ def query(add_repo):
     Returns:
     JSON encoded success boolean and error message if any.
     """
-    # Verify POST data.
     repo_url = request.form.get('repo_url')
     if not repo_url:
         return abort(400)
-    if repo_url.count('/') != 1:
-        return jsonify(success=False, error='Invalid GitHub URL, must have only one slash.')
-    for letter in repo_url:
-        if letter not in VALID_CHARACTERS:
-            return jsonify(success=False, error='Invalid GitHub URL, invalid character(s) found.')
+    return jsonify(**run_query(repo_url, add_repo))
+
+
+def run_query(repo_url, add_repo):
+    """Verifies an add/update request, then queries GitHub and saves the repo. Shared by query() and the async Tornado
+    handler in github_status.async_handlers.
+
+    Positional arguments:
+    repo_url -- the author and project names, part of the url (e.g. Robpol86/colorclass).
+    add_repo -- checks for repo_url collisions if True, otherwise checks for invalid repo_urls if False.
+
+    Returns:
+    Dictionary of the JSON response: success boolean, error message if any, and the background job's ID if any.
+    """
+    error = validate_repo_url(repo_url)
+    if error:
+        return dict(success=False, error=error)
 
     # Verify add/update request.
-    if add_repo and count(Repository.url, repo_url):
-        return jsonify(success=False, error='Repository already tracked, cannot add.')
-    elif not add_repo and not count(Repository.url, repo_url):
-        return jsonify(success=False, error='Repository not being tracked, cannot update.')
+    if add_repo and exists(Repository.url, repo_url):
+        return dict(success=False, error='Repository already tracked, cannot add.')
+    elif not add_repo and not exists(Repository.url, repo_url):
+        return dict(success=False, error='Repository not being tracked, cannot update.')
 
-    # Query for repo metadata.
+    # Query for repo metadata and add to database.
     try:
-        top_three, last_commit_message = get_committers_details(repo_url)
-        line_count = get_line_count(repo_url)
+        job_id = fetch_and_save(repo_url, add_repo)
     except APIError as e:
-        return jsonify(success=False, error=str(e))
-    top_three_str = ' '.join(sorted(top_three))
+        return dict(success=False, error=str(e))
+    except TimeoutError:
+        return dict(success=False, error='GitHub took too long to respond, try again later.')
+    if job_id:
+        return dict(success=True, error='', job=job_id)
+    return dict(success=True, error='')
+
+
+def _fetch_one(item):
+    """Like fetch_metadata() but calls the GitHub API sequentially, for bulk() which already runs it in a worker.
+
+    Positional arguments:
+    item -- tuple of the repo URL and its load_line_count_state() (loaded beforehand with one query for all repos).
+
+    Returns:
+    Tuple of the repo URL, fetch_metadata()'s dictionary (None on error), and the error message.
+    """
+    repo_url, state = item
+    try:
+        top_committers, last_commit_message = get_committers_details(repo_url)
+        try:
+            line_stats = get_line_stats(repo_url, state)
+        except StatsPendingError:
+            line_stats = None  # Line count fetched in the background.
+    except APIError as e:
+        return repo_url, None, str(e)
+    return repo_url, _payload(repo_url, line_stats, top_committers, last_commit_message), ''
+
+
+def _write_batch(rows, add_repo):
+    """Inserts or updates Repository rows with one executemany() per set of columns. Nothing is committed.
 
-    # Add to database.
-    payload = dict(url=repo_url, line_count=line_count, top_committers=top_three_str, last_commit=last_commit_message)
+    Raises:
+    sqlalchemy.exc.IntegrityError -- raised if a row being inserted already exists.
+
+    Positional arguments:
+    rows -- list of dictionaries returned by _row_values().
+    add_repo -- inserts new rows if True, otherwise updates existing ones.
+
+    Returns:
+    True if every row was written, False if some rows to update don't exist.
+    """
+    table, groups = Repository.__table__, dict()
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), list()).append(row)  # executemany() needs the same columns for all rows.
     if add_repo:
-        db.session.add(Repository(**payload))
-    else:
-        row = db.session.query(Repository).filter_by(url=repo_url)
-        row.update(payload)
+        for group in groups.values():
+            db.session.execute(table.insert(), [dict(r, writes=1) for r in group])
+        return True
+    statement = table.update().where(table.c.url_lower == bindparam('b_url_lower'))
+    statement = statement.values(writes=func.coalesce(table.c.writes, 0) + 1)
+    matched = sum(db.session.execute(statement, [dict(r, b_url_lower=r['url_lower']) for r in group]).rowcount
+                  for group in groups.values())
+    return matched == len(rows)
+
+
+def _save_all(payloads, add_repo):
+    """Inserts or updates Repository rows and creates background jobs for missing line counts, in one transaction.
+
+    Rows are written in bulk by _write_batch(). If a repo was added (or removed) by a concurrent request since bulk()
+    verified it, the batch is rolled back and rows are written one by one with upsert() instead, so only those repos
+    fail instead of the whole batch.
+
+    Positional arguments:
+    payloads -- list of dictionaries returned by fetch_metadata().
+    add_repo -- inserts new rows if True, otherwise updates existing ones.
+
+    Returns:
+    Tuple: dictionary of repo URLs which weren't written and their error messages, and the list of new Job IDs.
+    """
+    now, errors = datetime.utcnow(), dict()
+    rows = [_row_values(p, add_repo, now) for p in payloads]
+    try:
+        written = _write_batch(rows, add_repo)
+    except IntegrityError:
+        written = False
+    if not written:
+        db.session.rollback()
+        for row in rows:
+            if not upsert(Repository, row, 'url_lower', insert=add_repo, update=not add_repo, counter='writes'):
+                errors[row['url']] = _save_error(add_repo)
+    jobs = [Job(repo_url=p['url']) for p in payloads if p['line_count'] is None and p['url'] not in errors]
+    db.session.add_all(jobs)
+    if len(errors) < len(payloads):
+        bump_version(Repository)
     db.session.commit()
-    return jsonify(success=True, error='')
+    for payload in payloads:
+        if payload['url'] not in errors:
+            page_cache.invalidate(payload['url'])
+    for job in jobs:
+        workers.submit_later(current_app.config['GITHUB_STATS_BACKOFF'], finish_job, job.id)
+    return errors, [job.id for job in jobs]
+
+
+@api_query_github.route('/bulk/update', defaults=dict(add_repo=False), strict_slashes=False, methods=('POST',))
+@api_query_github.route('/bulk', defaults=dict(add_repo=True), strict_slashes=False, methods=('POST',))
+def bulk(add_repo):
+    """Same as query() for many repos at once. Expects a JSON list of repo URLs in the request body.
+
+    All URLs are verified in one pass and with one database query. Then repos are fetched from GitHub concurrently and
+    all rows are written in a single transaction.
+
+    Positional arguments:
+    add_repo -- checks for repo_url collisions if True, otherwise checks for invalid repo_urls if False.
+
+    Returns:
+    Streamed response with one JSON object per line. One for every repo (repo_url, success, error), errors as soon as
+    they're known and successes once the transaction is committed, then a final one (success, error, saved count, job
+    IDs).
+    """
+    repo_urls = request.get_json(force=True, silent=True)
+    if not isinstance(repo_urls, list) or not 0 < len(repo_urls) <= current_app.config['BULK_MAX_REPOS']:
+        return abort(400)
+    if not all(isinstance(u, basestring) and u for u in repo_urls):
+        return abort(400)
+
+    # Verify URLs and add/update request.
+    lowered = [u.lower() for u in repo_urls]
+    columns = (Repository.url, Repository.line_count_week, Repository.line_count_totals)
+    query = db.session.query(*columns).filter(Repository.url_lower.in_(set(lowered)))
+    tracked = dict((r[0].lower(), dict(line_count_week=r[1], line_count_totals=r[2])) for r in query)
+    results, to_fetch, seen = list(), list(), set()
+    for i, repo_url in enumerate(repo_urls):
+        error = validate_repo_url(repo_url)
+        if not error and lowered[i] in seen:
+            error = 'Duplicate repository URL.'
+        elif not error and add_repo and lowered[i] in tracked:
+            error = 'Repository already tracked, cannot add.'
+        elif not error and not add_repo and lowered[i] not in tracked:
+            error = 'Repository not being tracked, cannot update.'
+        seen.add(lowered[i])
+        if error:
+            results.append(dict(repo_url=repo_url, success=False, error=error))
+        else:
+            to_fetch.append((repo_url, None if add_repo else tracked[lowered[i]]))
+
+    def generate():
+        for result in results:
+            yield json.dumps(result) + '\n'
+
+        # Query GitHub.
+        payloads, pending = list(), set(repo_url for repo_url, _ in to_fetch)
+        iterator = workers.imap_unordered(_fetch_one, to_fetch)
+        try:
+            for _ in to_fetch:
+                repo_url, payload, error = iterator.next(current_app.config['GITHUB_QUERY_TIMEOUT'])
+                pending.discard(repo_url)
+                if payload:
+                    payloads.append(payload)  # Reported once committed.
+                else:
+                    yield json.dumps(dict(repo_url=repo_url, success=False, error=error)) + '\n'
+        except TimeoutError:
+            for repo_url in sorted(pending):
+                error = 'GitHub took too long to respond, try again later.'
+                yield json.dumps(dict(repo_url=repo_url, success=False, error=error)) + '\n'
+
+        # Add to database.
+        errors, job_ids = dict(), list()
+        if payloads:
+            try:
+                errors, job_ids = _save_all(payloads, add_repo)
+            except SQLAlchemyError:
+                db.session.rollback()
+                error = 'Failed to save repositories, try again.'
+                for payload in payloads:
+                    yield json.dumps(dict(repo_url=payload['url'], success=False, error=error)) + '\n'
+                yield json.dumps(dict(success=False, error=error, saved=0, jobs=list())) + '\n'
+                return
+        for payload in payloads:
+            error = errors.get(payload['url'], '')
+            yield json.dumps(dict(repo_url=payload['url'], success=not error, error=error)) + '\n'
+        yield json.dumps(dict(success=True, error='', saved=len(payloads) - len(errors), jobs=job_ids)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@api_query_github.route('/rate_limit')
+def rate_limit():
+    """Reports this process' view of the GitHub API rate limit quota.
+
+    Returns:
+    JSON encoded totals and a list of per-token quotas (limit, remaining, reset as a UNIX timestamp; null if unknown).
+    """
+    tokens = github.limiter.budget()
+    remaining = sum(t['remaining'] for t in tokens if t['remaining'] is not None)
+    return jsonify(success=True, error='', remaining=remaining, tokens=tokens)
+
+
+@api_query_github.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Reports the status of a background job started by query().
+
+    Positional arguments:
+    job_id -- the job ID returned by query().
+
+    Returns:
+    JSON encoded job status (pending, done, or failed) and error message if any.
+    """
+    job = Job.query.get_or_404(job_id)
+    return jsonify(success=job.status != 'failed', error=job.error, status=job.status, repo_url=job.repo_url,
+                   attempts=job.attempts)
@@ -0,0 +1,43 @@
+"""Convenience functions and decorators shared by views."""
+
+from functools import wraps
+import hashlib
+
+from flask import current_app, make_response, request
+from werkzeug.http import is_resource_modified, quote_etag
+
+
+def conditional(version):
+    """Decorator which adds ETag and Last-Modified headers to a view's responses. Conditional requests matching them
+    get an empty HTTP 304 response without calling the view, so no expensive queries or rendering.
+
+    Validators come from a cheap version of the data instead of hashing the response body. Responses are marked
+    no-cache so clients always revalidate instead of guessing freshness from Last-Modified.
+
+    Positional arguments:
+    version -- function called with the view's arguments. Returns a tuple of a string which changes whenever the data
+        shown by the view changes, and the datetime (UTC, may be None) of that change. Returns None if there's no
+        version (e.g. missing row), then the view is called without adding validators.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            current = version(*args, **kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+            tag, last_modified = current
+            etag = hashlib.sha1('{}:{}'.format(request.endpoint, tag)).hexdigest()
+            # Weak comparison, gzipped responses have weak ETags (see github_status.compression).
+            if not is_resource_modified(request.environ, etag=quote_etag(etag, weak=True), last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapped
+    return decorator
@@ -1,13 +1,20 @@
 from flask import render_template
 
 from github_status.blueprints import repos_details
+from github_status.extensions import page_cache
+from github_status.models.helpers import repository_version
 from github_status.models.repositories import Repository
+from github_status.views.helpers import conditional
 
 
 @repos_details.route('/<owner>/<project>')
+@conditional(lambda owner, project: repository_version('{}/{}'.format(owner, project)))
+@page_cache.cached(lambda owner, project: 'repo:{}/{}'.format(owner, project),
+                   lambda owner, project: repository_version('{}/{}'.format(owner, project)))
 def index(owner, project):
     repo_url = '{}/{}'.format(owner, project)
-    row = Repository.query.filter_by(url=repo_url).first_or_404()
-    return render_template('repos_details.html', url=row.url, line_count='{:,}'.format(row.line_count),
+    row = Repository.query.filter_by(url_lower=repo_url.lower()).first_or_404()
+    line_count = 'Still being generated by GitHub.' if row.line_count is None else '{:,}'.format(row.line_count)
+    return render_template('repos_details.html', url=row.url, line_count=line_count,
                            top_committers=row.top_committers.split(' '),
                            last_commit=row.last_commit.replace('\n', '<br>'))
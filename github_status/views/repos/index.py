@@ -1,14 +1,97 @@
-from flask import render_template
+from flask import abort, current_app, jsonify, render_template, request, url_for
+from sqlalchemy import func, or_
+from werkzeug.urls import url_encode
 
 from github_status.blueprints import repos_index
-from github_status.extensions import db
+from github_status.extensions import db, page_cache
+from github_status.models.helpers import repository_version
 from github_status.models.repositories import Repository
+from github_status.views.helpers import conditional
+
+# DataTables column indexes, in the same order as the table in repos_index.html.
+COLUMNS = (Repository.url, Repository.top_committers, Repository.last_commit_summary)
+
+
+def _int_arg(name, default):
+    """Reads an integer from the query string, aborts with HTTP 400 if it's not one."""
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        abort(400)
 
 
 @repos_index.route('/')
+@conditional(repository_version)
+@page_cache.cached(lambda: 'repos', repository_version)
 def index():
+    return render_template('repos_index.html')
+
+
+@repos_index.route('data')  # No leading slash, the blueprint's URL prefix is already '/'.
+@conditional(repository_version)
+def data():
+    """Implements the DataTables server-side processing protocol. Paging, ordering, and searching are done in SQL.
+
+    Query string arguments (sent by DataTables):
+    draw -- echoed back as an integer.
+    start -- offset of the first row.
+    length -- number of rows, limited to REPOS_INDEX_MAX_PAGE_LENGTH (-1 means all rows to DataTables).
+    search[value] -- case insensitive substring to look for in all columns.
+    order[i][column], order[i][dir] -- column index and direction ('asc' or 'desc') to sort by, in order of priority.
+
+    Responses are cached without draw, which changes with every request, and keyed on repository_version() (see
+    PageCache.cached()).
+
+    Returns:
+    JSON response with draw, recordsTotal, recordsFiltered, and data (list of url, details_url, top_committers, and
+    last_commit).
+    """
+    draw = _int_arg('draw', 0)
+    if not page_cache.enabled:
+        return jsonify(draw=draw, **_table_data())
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k not in ('draw', '_'))
+    key = page_cache.key('repos', '{}?{}#{}'.format(request.path, url_encode(args), repository_version()[0]))
+    table_data = page_cache.get(key)
+    if table_data is None:
+        table_data = _table_data()
+        page_cache.set(key, table_data)
+    return jsonify(draw=draw, **table_data)
+
+
+def _table_data():
+    """Queries the rows of one page for data(). Returns a dictionary of data()'s JSON, without draw."""
+    start = max(_int_arg('start', 0), 0)
+    max_length = current_app.config['REPOS_INDEX_MAX_PAGE_LENGTH']
+    length = _int_arg('length', max_length)
+    length = max_length if length < 0 else min(length, max_length)
+
+    records_total = db.session.query(func.count(Repository.id)).scalar()
+    query = db.session.query(*COLUMNS)
+
+    # Search.
+    search = request.args.get('search[value]', '').strip()
+    if search:
+        pattern = '%{}%'.format(search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+        query = query.filter(or_(*[func.lower(c).like(pattern.lower(), escape='\\') for c in COLUMNS]))
+        records_filtered = query.order_by(None).count()
+    else:
+        records_filtered = records_total
+
+    # Order.
+    for i in range(len(COLUMNS)):
+        column = request.args.get('order[{}][column]'.format(i))
+        if column is None:
+            break
+        if not column.isdigit() or int(column) >= len(COLUMNS):
+            abort(400)
+        descending = request.args.get('order[{}][dir]'.format(i)) == 'desc'
+        query = query.order_by(COLUMNS[int(column)].desc() if descending else COLUMNS[int(column)])
+    query = query.order_by(Repository.id)  # Stable pages when sorted values are equal.
+
     table_rows = list()
-    for row in db.session.query(Repository.url, Repository.top_committers, Repository.last_commit):
-        last_commit = row[2].splitlines()[0][:80]
-        table_rows.append(dict(url=row[0], top_committers=row[1].split(' '), last_commit=last_commit))
-    return render_template('repos_index.html', table_rows=table_rows)
+    for url, top_committers, last_commit in query.offset(start).limit(length):
+        owner, project = url.split('/', 1)
+        table_rows.append(dict(url=url, details_url=url_for('repos.details.index', owner=owner, project=project),
+                               top_committers=top_committers.split(' ') if top_committers else list(),
+                               last_commit=last_commit or ''))
+    return dict(recordsTotal=records_total, recordsFiltered=records_filtered, data=table_rows)
@@ -9,28 +9,56 @@ Command details:
                         Server. Auto-reloads files when they change.
     prodserver          Run the application with Facebook's Tornado web
                         server. Forks into multiple processes to handle
-                        several requests.
+                        several requests. Send SIGHUP to reload without
+                        dropping connections.
     shell               Starts a Python interactive shell with the Flask
                         application context.
     create_all          Only create database tables if they don't exist and
                         then exit.
+    migrate             Create missing tables, add missing columns and
+                        indexes to existing tables, and backfill computed
+                        columns, then exit.
+    refresh             Refresh every tracked repository's metadata from
+                        GitHub, stalest first, then exit. Keeps running if
+                        --interval is specified.
+    build_static        Write content-hashed and gzipped copies of all
+                        static files to STATIC_BUILD_FOLDER, then exit.
+                        Servers started afterwards link to and serve them.
 
 Usage:
     manage.py devserver [-p NUM] [-l DIR] [--config_prod]
-    manage.py prodserver [-p NUM] [-l DIR] [--config_prod]
+    manage.py prodserver [-p NUM] [-l DIR] [-n NUM] [-m NUM] [-t NUM]
+                         [--config_prod]
     manage.py shell [--config_prod]
     manage.py create_all [--config_prod]
+    manage.py migrate [-b NUM] [--config_prod]
+    manage.py refresh [-b NUM] [-c NUM] [-i SEC] [-l DIR] [--config_prod]
+    manage.py build_static [--config_prod]
     manage.py (-h | --help)
 
 Options:
+    -b NUM --batch_size=NUM     Number of repositories to refresh or backfill
+                                per batch. [default: 100]
+    -c NUM --concurrency=NUM    Number of repositories to refresh at the same
+                                time. [default: 4]
     --config_prod               Load the production configuration instead of
                                 development.
+    -i SEC --interval=SEC       Start a new refresh pass every SEC seconds
+                                instead of exiting after one pass.
     -l DIR --log_dir=DIR        Log all statements to file in this directory
                                 instead of stdout.
                                 Only ERROR statements will go to stdout. stderr
                                 is not used.
+    -m NUM --max_requests=NUM   Replace each process after it served NUM
+                                requests. 0 for no limit. [default: 0]
+    -n NUM --processes=NUM      Number of processes serving requests. 0 for
+                                one per CPU. [default: 0]
     -p NUM --port=NUM           Flask will listen on this port number.
                                 [default: 5000]
+    -t NUM --workers_threads=NUM
+                                Run Flask requests in a pool of NUM threads per
+                                process instead of in Tornado's IOLoop. 0 to
+                                disable. [default: 0]
 """
 
 from __future__ import print_function
@@ -44,10 +72,17 @@ import sys
 from docopt import docopt
 import flask
 from flask.ext.script import Shell
-from tornado import httpserver, ioloop, web, wsgi
-
-from github_status.application import create_app, get_config
-from github_status.extensions import db
+from tornado import netutil, web, wsgi
+
+from github_status.application import create_app, get_config, STATIC_FOLDER, warm_up
+from github_status.async_handlers import QueryHandler
+from github_status.extensions import db, static_files, workers
+from github_status.models.helpers import add_missing_columns, backfill_computed_columns
+from github_status.prefork import inherited_sockets, PreforkServer
+from github_status.scheduler import refresh_all, run_forever
+from github_status.static_assets import build, StaticFileHandler
+from github_status.threaded_wsgi import ThreadedWSGIContainer
+from github_status.views.api.query_github import resume_jobs_forever
 
 OPTIONS = docopt(__doc__) if __name__ == '__main__' else dict()
 
@@ -161,18 +196,31 @@ def prodserver():
     log_messages(app, OPTIONS['--port'])
 
     # Setup the application.
-    container = wsgi.WSGIContainer(app)
+    threads = int(OPTIONS['--workers_threads'])
+    if threads:
+        container = ThreadedWSGIContainer(app, threads, app.config['WSGI_QUEUE_SIZE'])
+    else:
+        container = wsgi.WSGIContainer(app)
+    static = dict(path=app.static_folder, manifest=static_files.manifest)
     application = web.Application([
-        (r'/(favicon\.ico)', web.StaticFileHandler, dict(path=app.static_folder)),
-        (r'/static/(.*)', web.StaticFileHandler, dict(path=app.static_folder)),
+        (r'/(favicon\.ico)', StaticFileHandler, static),
+        (r'/static/(.*)', StaticFileHandler, static),
+        (r'/api/query_github/?', QueryHandler, dict(app=app, add_repo=True)),
+        (r'/api/query_github/update/?', QueryHandler, dict(app=app, add_repo=False)),
         (r'.*', web.FallbackHandler, dict(fallback=container))
     ])  # From http://maxburstein.com/blog/django-static-files-heroku/
-    http_server = httpserver.HTTPServer(application)
-    http_server.bind(OPTIONS['--port'])
+    sockets = inherited_sockets() or netutil.bind_sockets(int(OPTIONS['--port']))
+    warm_up(app)
+    db.get_engine(app).dispose()  # Children open their own connections.
+
+    def on_child_start():
+        with app.app_context():
+            workers.submit(resume_jobs_forever)  # Jobs of replaced or crashed children, see resume_jobs().
 
     # Start the server.
-    http_server.start(0)  # Forks multiple sub-processes
-    ioloop.IOLoop.instance().start()
+    server = PreforkServer(application, sockets, int(OPTIONS['--processes']), int(OPTIONS['--max_requests']),
+                           app.config['GRACEFUL_TIMEOUT'], on_child_start=on_child_start)
+    server.run()  # Forks multiple sub-processes
 
 
 @command
@@ -197,6 +245,44 @@ def create_all():
         log.info('Created table: {}'.format(table))
 
 
+@command
+def migrate():
+    setup_logging('migrate')
+    app = create_app(parse_options())
+    log = logging.getLogger(__name__)
+    with app.app_context():
+        db.create_all()
+        for table in db.metadata.sorted_tables:
+            for name in add_missing_columns(table):
+                log.info('Added to table {}: {}'.format(table.name, name))
+        updated = backfill_computed_columns(int(OPTIONS['--batch_size']))
+    log.info('Backfilled {} repositories.'.format(updated))
+
+
+@command
+def refresh():
+    setup_logging('refresh')
+    app = create_app(parse_options())
+    log = logging.getLogger(__name__)
+    batch_size, concurrency = int(OPTIONS['--batch_size']), int(OPTIONS['--concurrency'])
+    with app.app_context():
+        if OPTIONS['--interval']:
+            run_forever(batch_size, concurrency, float(OPTIONS['--interval']))
+        successes, failures = refresh_all(batch_size, concurrency)
+        log.info('Waiting for line count jobs to finish.')
+        workers.wait_scheduled()  # Their retries are timers in this process.
+    log.info('Refreshed {} repositories, {} failed.'.format(successes, failures))
+
+
+@command
+def build_static():
+    setup_logging('build_static')
+    app = create_app(parse_options())
+    log = logging.getLogger(__name__)
+    manifest = build(STATIC_FOLDER, app.config['STATIC_BUILD_FOLDER'])
+    log.info('Built {} static files into {}.'.format(len(manifest), app.config['STATIC_BUILD_FOLDER']))
+
+
 if __name__ == '__main__':
     signal.signal(signal.SIGINT, lambda *_: sys.exit(0))  # Properly handle Control+C
     if not OPTIONS['--port'].isdigit():
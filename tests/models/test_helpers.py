@@ -1,6 +1,12 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text
+from sqlalchemy.exc import IntegrityError
+
 from github_status.extensions import db
-from github_status.models.helpers import count
-from github_status.models.repositories import Repository
+from github_status.models.helpers import (add_missing_columns, advisory_lock, backfill_computed_columns, bump_version,
+                                          count, exists, repository_version, upsert)
+from github_status.models.repositories import Repository, summarize
+from github_status.models.versions import TableVersion
 
 
 def test_count():
@@ -24,3 +30,119 @@ def test_count():
     assert 1 == count(Repository.url, 'user1/projecta')
     assert 0 == count(Repository.url, 'user1/project%')
     assert 2 == count(Repository.url, 'user1/project%', True)
+
+
+def test_exists():
+    Repository.query.delete()
+    db.session.add(Repository(url='User1/ProjectA'))
+    db.session.add(Repository(url='user2/projectB'))
+    db.session.commit()
+    assert 'user1/projecta' == db.session.query(Repository.url_lower).filter_by(url='User1/ProjectA').scalar()
+
+    assert exists(Repository.url, 'user1/PROJECTA') is True
+    assert exists(Repository.url, 'user1/project') is False
+    assert exists(Repository.url, 'USER1/%', True) is True
+    assert exists(Repository.url, 'user3/%', True) is False
+    assert exists(Repository.url, '%/projectb', True) is True
+    assert 2 == count(Repository.url, '%project_', True)
+    assert 1 == count(Repository.url, 'user_/projecta', True)
+    assert 0 == count(Repository.url, 'user1/projecta_', True)
+
+
+def test_repository_version():
+    Repository.query.delete()
+    db.session.add(Repository(url='User1/ProjectA'))
+    db.session.commit()
+    assert repository_version('user1/projecta') is not None
+    assert repository_version('user1/projectb') is None
+
+    # Same second, different write.
+    version = repository_version('user1/projecta')
+    Repository.query.filter_by(url='User1/ProjectA').update(dict(writes=1))
+    db.session.commit()
+    assert version[1] == repository_version('user1/projecta')[1]
+    assert version[0] != repository_version('user1/projecta')[0]
+
+    TableVersion.query.delete()
+    db.session.commit()
+    assert ('0:None', None) == repository_version()
+    bump_version(Repository)  # Inserts the row.
+    bump_version(Repository)
+    db.session.commit()
+    assert ('2:None', None) == repository_version()
+    assert 2 == TableVersion.query.get('repository').version
+
+
+def test_advisory_lock_sqlite():
+    with advisory_lock('user1/projectA', 1) as locked:
+        assert locked is False  # Not supported by SQLite, runs unlocked.
+
+
+def test_add_missing_columns():
+    db.session.execute('CREATE TABLE migrate_test (id INTEGER PRIMARY KEY, url VARCHAR(255))')
+    db.session.commit()
+    table = Table('migrate_test', MetaData(), Column('id', Integer, primary_key=True), Column('url', String(255)),
+                  Column('summary', String(80), index=True), Column('body', Text))
+    try:
+        assert ['summary', 'body', 'ix_migrate_test_summary'] == add_missing_columns(table)
+        assert list() == add_missing_columns(table)
+        db.session.execute(table.insert(), dict(url='a/b', summary='Summary.', body='Body.'))
+        assert [(1, 'a/b', 'Summary.', 'Body.')] == db.session.execute(table.select()).fetchall()
+    finally:
+        db.session.rollback()
+        db.session.execute('DROP TABLE migrate_test')
+        db.session.commit()
+
+
+def test_backfill_computed_columns():
+    Repository.query.delete()
+    for i in range(5):
+        db.session.add(Repository(url='User1/Project{}'.format(i), last_commit='Commit {}.\n\nDetails.'.format(i)))
+    db.session.add(Repository(url='user1/done', last_commit='Old.', last_commit_summary='Done.'))
+    db.session.add(Repository(url='user1/none'))
+    db.session.commit()
+    Repository.query.update(dict(url_lower=None))
+    db.session.commit()
+
+    assert 7 == backfill_computed_columns(2)
+    assert 0 == backfill_computed_columns(2)
+    expected = [('user1/done', 'Done.'), ('user1/none', None)] + [
+        ('user1/project{}'.format(i), 'Commit {}.'.format(i)) for i in range(5)]
+    actual = db.session.query(Repository.url_lower, Repository.last_commit_summary).order_by(Repository.url_lower)
+    assert expected == actual.all()
+
+
+def test_summarize():
+    assert '' == summarize(None)
+    assert 'Fix bug.' == summarize('Fix bug.\r\n\r\nDetails.')
+    assert 'a' * 80 == summarize('a' * 100)
+
+
+def test_upsert():
+    Repository.query.delete()
+    db.session.commit()
+    values = dict(url='User1/ProjectA', url_lower='user1/projecta', line_count=1)
+
+    assert upsert(Repository, values, 'url_lower', insert=False) is None
+    assert 'inserted' == upsert(Repository, values, 'url_lower', update=False)
+    assert upsert(Repository, dict(values, line_count=2), 'url_lower', update=False) is None
+    assert 'updated' == upsert(Repository, dict(values, url='user1/projectA', line_count=3), 'url_lower', insert=False)
+    assert 'updated' == upsert(Repository, dict(values, line_count=4), 'url_lower')
+    assert 'inserted' == upsert(Repository, dict(url='user1/b', url_lower='user1/b', line_count=5), 'url_lower')
+
+    # Not an existing row, raised without aborting the transaction.
+    with pytest.raises(IntegrityError):
+        upsert(Repository, dict(url=None, url_lower='user1/d'), 'url_lower', update=False)
+    db.session.commit()
+
+    expected = [('User1/ProjectA', 4), ('user1/b', 5)]
+    assert expected == db.session.query(Repository.url, Repository.line_count).order_by(Repository.id).all()
+
+    # Write counters, NULL in rows written without one.
+    assert 'updated' == upsert(Repository, dict(values, line_count=6), 'url_lower', counter='writes')
+    assert 'updated' == upsert(Repository, dict(values, line_count=7), 'url_lower', counter='writes')
+    assert 'inserted' == upsert(Repository, dict(url='user1/c', url_lower='user1/c'), 'url_lower', counter='writes')
+    db.session.commit()
+    expected = [('User1/ProjectA', 7, 2), ('user1/b', 5, None), ('user1/c', None, 1)]
+    assert expected == db.session.query(Repository.url, Repository.line_count, Repository.writes).order_by(
+        Repository.id).all()
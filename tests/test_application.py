@@ -1,4 +1,6 @@
-from github_status.application import get_config
+from flask import current_app
+
+from github_status.application import get_config, warm_up
 
 
 def test_get_config_yaml(tmpdir):
@@ -8,3 +10,9 @@ def test_get_config_yaml(tmpdir):
     config = get_config('github_status.config.Testing', yaml_files=[str(f)])
 
     assert config.TEST_VAR is True
+
+
+def test_warm_up():
+    warm_up(current_app)
+    cached = {t.name for t in current_app.jinja_env.cache.values()}
+    assert {'base.html', 'repos_index.html'} <= cached
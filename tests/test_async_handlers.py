@@ -0,0 +1,69 @@
+import json
+import time
+from urllib import urlencode
+
+from flask import current_app
+from tornado import gen, httpclient, httpserver, ioloop, testing, web
+
+from github_status.async_handlers import QueryHandler
+from github_status.extensions import db
+from github_status.models.repositories import Repository
+from github_status.views.api import query_github
+
+
+def fetch_all(bodies):
+    """Starts a Tornado server with the async handlers and POSTs all bodies to it concurrently.
+
+    Returns:
+    List of (status code, decoded JSON or None) tuples in the same order as bodies.
+    """
+    io_loop = ioloop.IOLoop()
+    io_loop.make_current()
+    application = web.Application([(r'/api/query_github/?', QueryHandler, dict(app=current_app, add_repo=True))])
+    sock, port = testing.bind_unused_port()
+    server = httpserver.HTTPServer(application, io_loop=io_loop)
+    server.add_sockets([sock])
+    client = httpclient.AsyncHTTPClient(io_loop, force_instance=True)
+
+    @gen.coroutine
+    def fetch():
+        url = 'http://127.0.0.1:{}/api/query_github'.format(port)
+        # gen.Task passes a callback, fetch() doesn't raise on error status codes then.
+        responses = yield [gen.Task(client.fetch, url, method='POST', body=urlencode(b)) for b in bodies]
+        raise gen.Return([(r.code, json.loads(r.body) if r.code == 200 else None) for r in responses])
+
+    try:
+        return io_loop.run_sync(fetch, timeout=10)
+    finally:
+        client.close()
+        server.stop()
+        ioloop.IOLoop.clear_current()
+        io_loop.close(all_fds=True)
+
+
+def test_bad_request():
+    assert [(400, None)] == fetch_all([dict()])
+
+
+def test_invalid():
+    expected = dict(success=False, error='Invalid GitHub URL, must have only one slash.')
+    assert [(200, expected)] == fetch_all([dict(repo_url='1/2/3')])
+
+
+def test_concurrent(monkeypatch):
+    Repository.query.delete()
+    db.session.commit()
+
+    def fetch_and_save(repo_url, add_repo):
+        assert add_repo is True
+        time.sleep(0.5)  # A slow GitHub API call.
+        return repo_url
+    monkeypatch.setattr(query_github, 'fetch_and_save', fetch_and_save)
+
+    start = time.time()
+    actual = fetch_all([dict(repo_url='owner/project{}'.format(i)) for i in range(4)])
+    elapsed = time.time() - start
+
+    expected = [(200, dict(success=True, error='', job='owner/project{}'.format(i))) for i in range(4)]
+    assert expected == actual
+    assert elapsed < 1.5  # Served one after the other would take at least 2 seconds.
@@ -0,0 +1,97 @@
+import itertools
+import os
+import time
+
+import pytest
+
+from github_status.cache import check_private, create_cache, FileCache, MemoryCache, SQLiteCache
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'file'])
+def cache(request, tmpdir):
+    path = str(tmpdir.join('cache.sqlite' if request.param == 'sqlite' else 'cache'))
+    return create_cache(request.param, path, 3)
+
+
+def test_create_cache(tmpdir):
+    assert create_cache(None, None, 3) is None
+    assert isinstance(create_cache('memory', None, 3), MemoryCache)
+    assert isinstance(create_cache('sqlite', str(tmpdir.join('cache.sqlite')), 3), SQLiteCache)
+    assert isinstance(create_cache('file', str(tmpdir.join('cache')), 3), FileCache)
+    with pytest.raises(ValueError):
+        create_cache('redis', None, 3)
+
+
+def test_check_private(tmpdir):
+    check_private(str(tmpdir.join('cache.sqlite')))
+    tmpdir.join('cache.sqlite').write('')
+    check_private(str(tmpdir.join('cache.sqlite')))
+
+    with pytest.raises(ValueError):
+        check_private(None)
+    with pytest.raises(ValueError):
+        check_private(str(tmpdir.join('missing', 'cache.sqlite')))
+
+    # Other users could plant pickles.
+    tmpdir.join('cache.sqlite').chmod(0o666)
+    with pytest.raises(ValueError):
+        check_private(str(tmpdir.join('cache.sqlite')))
+    shared = tmpdir.mkdir('shared')
+    shared.chmod(0o1777)
+    for backend in ('sqlite', 'file'):
+        with pytest.raises(ValueError):
+            create_cache(backend, str(shared.join('cache')), 3)
+    assert not os.listdir(str(shared))
+
+
+def test_get_set_delete(cache):
+    assert cache.get('a') is None
+
+    value = dict(etag='"abc"', value=({'Robpol86', }, u'Commit message.'))
+    cache.set('a', value)
+    value['etag'] = None  # Mutating the caller's copy doesn't change the cache.
+    assert dict(etag='"abc"', value=({'Robpol86', }, u'Commit message.')) == cache.get('a')
+
+    cache.set('a', 1)
+    assert 1 == cache.get('a')
+
+    cache.delete('a')
+    cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_lru_eviction(cache, monkeypatch):
+    clock = itertools.count(time.time())
+    monkeypatch.setattr('time.time', lambda: next(clock))  # Ensures SQLite backend timestamps always increase.
+
+    for key in 'abc':
+        cache.set(key, key)
+    assert 'a' == cache.get('a')  # 'b' is now the least recently used.
+    cache.set('d', 'd')
+
+    assert [None, 'a', 'c', 'd'] == [cache.get(k) for k in 'bacd']
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite', 'file'])
+def test_no_lru(tmpdir, monkeypatch, backend):
+    clock = itertools.count(time.time())
+    monkeypatch.setattr('time.time', lambda: next(clock))
+    path = str(tmpdir.join('cache.sqlite' if backend == 'sqlite' else 'cache'))
+    cache = create_cache(backend, path, 3, lru=False)
+
+    for key in 'abc':
+        cache.set(key, key)
+    before = tmpdir.join('cache.sqlite').read_binary() if backend == 'sqlite' else None
+    assert 'a' == cache.get('a')  # 'a' is still the least recently written.
+    if backend == 'sqlite':
+        assert before == tmpdir.join('cache.sqlite').read_binary()  # Reading didn't write.
+    cache.set('d', 'd')
+
+    assert [None, 'b', 'c', 'd'] == [cache.get(k) for k in 'abcd']
+
+
+def test_clear(cache):
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.clear()
+    assert [None, None] == [cache.get(k) for k in 'ab']
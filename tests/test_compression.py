@@ -0,0 +1,129 @@
+import gzip
+from StringIO import StringIO
+
+from flask import current_app
+import pytest
+
+from github_status.compression import accepts_gzip, GzipMiddleware
+
+
+def call(application, method='GET', accept_encoding='gzip, deflate'):
+    """Calls a WSGI application like a server would.
+
+    Returns:
+    Tuple of status string, dictionary of headers, and the body.
+    """
+    environ = dict(REQUEST_METHOD=method, HTTP_ACCEPT_ENCODING=accept_encoding)
+    response = dict()
+
+    def start_response(status, headers, exc_info=None):
+        response.update(status=status, headers=dict(headers))
+        return lambda data: None
+
+    app_iter = application(environ, start_response)
+    try:
+        body = ''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return response['status'], response['headers'], body
+
+
+def make_application(body, content_type='text/html; charset=utf-8', content_length=True, **headers):
+    """Returns a WSGI application yielding the body in small chunks, and a list set to True when it's closed."""
+    closed = list()
+
+    class Iterable(object):
+        def __iter__(self):
+            return (body[i:i + 100] for i in range(0, len(body), 100))
+
+        def close(self):
+            closed.append(True)
+
+    def application(environ, start_response):
+        response_headers = [('Content-Type', content_type)] + headers.items()
+        if content_length:
+            response_headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', response_headers)
+        return Iterable()
+    return application, closed
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+@pytest.mark.parametrize('accept_encoding,expected', [
+    ('gzip', True),
+    ('gzip, deflate, sdch', True),
+    ('deflate, GZIP;q=0.5', True),
+    ('*', True),
+    ('', False),
+    ('identity', False),
+    ('gzip;q=0', False),
+    ('gzip;q=0.0, *', False),
+    ('deflate, *;q=0', False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert expected is accepts_gzip(accept_encoding)
+
+
+def test_compress():
+    body = '<tr><td>Robpol86/Flask-Large-App-Example-2</td></tr>\n' * 200
+    application, closed = make_application(body, Vary='Cookie', ETag='"abc"')
+    status, headers, compressed = call(GzipMiddleware(application, 500, ['text/html']))
+
+    assert '200 OK' == status
+    assert body == gunzip(compressed)
+    assert len(compressed) * 10 < len(body)
+    assert 'gzip' == headers['Content-Encoding']
+    assert 'Cookie, Accept-Encoding' == headers['Vary']
+    assert 'W/"abc"' == headers['ETag']
+    assert 'Content-Length' not in headers
+    assert [True] == closed
+
+
+def test_streamed():
+    application = make_application('{"a": 1}', 'application/json', content_length=False)[0]
+    headers, compressed = call(GzipMiddleware(application, 500, ['application/json']))[1:]
+    assert 'gzip' == headers['Content-Encoding']
+    assert '{"a": 1}' == gunzip(compressed)
+
+
+@pytest.mark.parametrize('kwargs,method,accept_encoding,vary', [
+    (dict(body='x' * 499), 'GET', 'gzip', 'Accept-Encoding'),
+    (dict(body='x' * 1000), 'GET', 'identity', 'Accept-Encoding'),
+    (dict(body='x' * 1000), 'HEAD', 'gzip', 'Accept-Encoding'),
+    (dict(body='x' * 1000, content_type='image/png'), 'GET', 'gzip', None),
+    (dict(body='x' * 1000, **{'Content-Encoding': 'br'}), 'GET', 'gzip', 'Accept-Encoding'),
+    (dict(body='x' * 1000, **{'Cache-Control': 'no-transform'}), 'GET', 'gzip', 'Accept-Encoding'),
+])
+def test_not_compressed(kwargs, method, accept_encoding, vary):
+    application, closed = make_application(**kwargs)
+    headers, body = call(GzipMiddleware(application, 500, ['text/html']), method, accept_encoding)[1:]
+    assert kwargs['body'] == body
+    assert 'gzip' != headers.get('Content-Encoding')
+    assert str(len(body)) == headers['Content-Length']
+    assert vary == headers.get('Vary')
+    assert [True] == closed
+
+
+def test_flask():
+    client = current_app.test_client()
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 200 == response.status_code
+    assert 'gzip' == response.headers['Content-Encoding']
+    assert 'Accept-Encoding' == response.headers['Vary']
+    assert '</html>' in gunzip(response.data)
+
+    # Revalidating with the weak ETag of the gzipped page.
+    etag = response.headers['ETag']
+    assert etag.startswith('W/"')
+    response = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert 304 == response.status_code
+    assert etag == response.headers['ETag']
+
+    response = client.get('/')
+    assert 'Content-Encoding' not in response.headers
+    assert '</html>' in response.data
+    assert not response.headers['ETag'].startswith('W/')
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+
+from flask import current_app
+import pytest
+from sqlalchemy.exc import TimeoutError
+
+from github_status.pool import MeteredQueuePool
+
+
+@pytest.fixture
+def pool():
+    return MeteredQueuePool(lambda: sqlite3.connect(':memory:', check_same_thread=False), pool_size=1,
+                            max_overflow=0, timeout=0.1, pre_ping=True)
+
+
+def test_metrics(pool):
+    connection = pool.connect()
+    with pytest.raises(TimeoutError):
+        pool.connect()
+    connection.close()
+    pool.connect().close()
+
+    stats = pool.stats()
+    assert (2, 1, 1, 0) == (stats['checkouts'], stats['timeouts'], stats['connects'], stats['disconnects'])
+    assert 0.1 <= stats['max_wait_seconds'] <= stats['wait_seconds']
+    assert (1, 1, 0) == (stats['size'], stats['checked_in'], stats['checked_out'])
+
+
+def test_pre_ping(pool):
+    connection = pool.connect()
+    dbapi_connection = connection.connection
+    connection.close()
+    dbapi_connection.close()  # Closed by the server while idle in the pool.
+
+    connection = pool.connect()
+    assert [(1, )] == connection.cursor().execute('SELECT 1').fetchall()
+    connection.close()
+    assert (2, 1) == (pool.stats()['connects'], pool.stats()['disconnects'])
+
+
+def test_fork(pool, monkeypatch):
+    pool.connect().close()
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    pool.connect().close()
+    assert (2, 1) == (pool.stats()['connects'], pool.stats()['disconnects'])
+
+    # Metrics survive Engine.dispose().
+    recreated = pool.recreate()
+    assert recreated.pre_ping is True
+    assert recreated.metrics is pool.metrics
+
+
+def test_endpoint():
+    response = current_app.test_client().get('/api/health/db_pool')
+    assert '200 OK' == response.status
+    assert 'NullPool' in response.data
@@ -0,0 +1,108 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import time
+import urllib2
+
+import pytest
+
+SCRIPT = textwrap.dedent("""\
+    import os
+    import sys
+
+    from tornado import netutil, web
+
+    from github_status.prefork import inherited_sockets, PreforkServer
+
+
+    class PidHandler(web.RequestHandler):
+        def get(self):
+            self.write(str(os.getpid()))
+
+
+    sockets = inherited_sockets() or netutil.bind_sockets(int(sys.argv[1]), '127.0.0.1')
+    PreforkServer(web.Application([(r'/', PidHandler)]), sockets, 2, int(sys.argv[2]), 5).run()
+""")
+
+
+@pytest.fixture
+def start(request, tmpdir):
+    """Returns a function starting a master serving its children's PIDs, and its port. Stopped after the test."""
+    script = tmpdir.join('server.py')
+    script.write(SCRIPT)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    def func(max_requests):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        master = subprocess.Popen([sys.executable, str(script), str(port), str(max_requests)], env=env)
+        request.addfinalizer(lambda: master.poll() is None and master.kill())
+        for _ in range(100):
+            try:
+                get(port)
+                break
+            except IOError:
+                time.sleep(0.1)
+        return master, port
+    return func
+
+
+def get(port):
+    """Returns the PID of the child serving the request."""
+    return int(urllib2.urlopen('http://127.0.0.1:{}/'.format(port), timeout=5).read())
+
+
+def wait(master):
+    """Waits for the master to exit and returns its exit status."""
+    for _ in range(100):
+        if master.poll() is not None:
+            return master.returncode
+        time.sleep(0.1)
+    raise RuntimeError('Master still running.')
+
+
+def test_max_requests(start):
+    master, port = start(max_requests=3)
+    assert 3 <= len({get(port) for _ in range(12)})  # About 3 requests per child, one more may slip in while stopping.
+
+    master.send_signal(signal.SIGTERM)
+    assert 0 == wait(master)
+
+
+def test_crash(start):
+    master, port = start(max_requests=0)
+    crashed = get(port)
+    os.kill(crashed, signal.SIGKILL)
+    time.sleep(0.5)
+    assert crashed not in [get(port) for _ in range(6)]  # Replaced, no request failed.
+
+    master.send_signal(signal.SIGTERM)
+    assert 0 == wait(master)
+
+
+def test_reload(start):
+    master, port = start(max_requests=0)
+    old = {get(port) for _ in range(10)}
+
+    master.send_signal(signal.SIGHUP)
+    new = set()
+    for _ in range(100):  # No request may fail while children are replaced.
+        pid = get(port)
+        if pid not in old:
+            new.add(pid)
+        if len(new) == 2:
+            break
+        time.sleep(0.05)
+    assert 2 == len(new)
+    assert master.poll() is None  # Same master process (PID), new code.
+
+    time.sleep(0.5)
+    assert new.issuperset(get(port) for _ in range(10))  # Old children are gone.
+
+    master.send_signal(signal.SIGINT)
+    assert 0 == wait(master)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from github_status.rate_limit import RateLimiter, RateLimitError, UNKNOWN_RESET_DELAY
+
+
+def headers(remaining, reset, limit=5000):
+    return {'X-RateLimit-Limit': str(limit), 'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)}
+
+
+def test_anonymous():
+    limiter = RateLimiter(list(), 0)
+    assert [dict(limit=None, remaining=None, reset=None)] == limiter.budget()
+    assert limiter.acquire() is None
+
+    limiter.update(None, dict())  # No headers, nothing changes.
+    assert [dict(limit=None, remaining=None, reset=None)] == limiter.budget()
+
+    reset = int(time.time()) + 3600
+    limiter.update(None, headers(2, reset, 60))
+    assert [dict(limit=60, remaining=2, reset=reset)] == limiter.budget()
+    assert limiter.acquire() is None
+    assert limiter.acquire() is None
+    with pytest.raises(RateLimitError) as e:
+        limiter.acquire()
+    assert reset == e.value.reset
+    assert [dict(limit=60, remaining=0, reset=reset)] == limiter.budget()
+
+
+def test_round_robin():
+    limiter = RateLimiter(['a', 'b', 'c'], 0)
+    assert ['a', 'b', 'c', 'a'] == [limiter.acquire() for _ in range(4)]
+
+    reset = int(time.time()) + 3600
+    limiter.update('b', headers(0, reset))
+    assert ['c', 'a', 'c', 'a'] == [limiter.acquire() for _ in range(4)]
+
+    limiter.update('a', headers(1, reset))
+    limiter.update('c', headers(0, reset))
+    assert 'a' == limiter.acquire()
+    with pytest.raises(RateLimitError):
+        limiter.acquire()
+
+
+def test_wait_for_reset():
+    limiter = RateLimiter(['a'], 5)
+    limiter.update('a', headers(0, time.time() + 0.5))
+
+    start = time.time()
+    assert 'a' == limiter.acquire()
+    assert 0.4 < time.time() - start < 2
+
+
+def test_wait_notified():
+    limiter = RateLimiter(['a'], 0)
+    limiter.update('a', headers(0, time.time() + 3600))
+
+    timer = threading.Timer(0.2, limiter.update, ('a', headers(10, time.time() + 3600)))
+    timer.start()
+    start = time.time()
+    limiter.wait()
+    assert time.time() - start < 2
+    assert 'a' == limiter.acquire()
+
+
+@pytest.mark.parametrize('reset', [None, 1])
+def test_reset_unknown(reset):
+    limiter = RateLimiter(['a'], 0)
+    response_headers = headers(0, reset)
+    if reset is None:
+        response_headers.pop('X-RateLimit-Reset')
+    limiter.update('a', response_headers)  # Missing, or in the past because of clock skew.
+
+    with pytest.raises(RateLimitError) as e:
+        limiter.acquire()
+    assert time.time() + UNKNOWN_RESET_DELAY - 5 < e.value.reset <= time.time() + UNKNOWN_RESET_DELAY
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from github_status import scheduler
+from github_status.extensions import db
+from github_status.models.repositories import Repository
+from github_status.views.api import query_github
+from github_status.views.api.query_github import APIError
+
+
+def test_refresh_all(monkeypatch):
+    Repository.query.delete()
+    db.session.add(Repository(url='a/fresh', line_count=1, last_refreshed=datetime(2014, 12, 1)))
+    db.session.add(Repository(url='a/never', line_count=1))
+    db.session.add(Repository(url='a/stale', line_count=1, last_refreshed=datetime(2014, 1, 1)))
+    db.session.add(Repository(url='a/broken', line_count=1, last_refreshed=datetime(2014, 6, 1)))
+    db.session.commit()
+
+    fetched = list()
+
+    def fetch_metadata(repo_url):
+        fetched.append(repo_url)
+        if repo_url == 'a/broken':
+            raise APIError('Invalid GitHub URL specified.')
+        return dict(url=repo_url, line_count=2, top_committers='me', last_commit='Refreshed.')
+    monkeypatch.setattr(query_github, 'fetch_metadata', fetch_metadata)
+    resumed = list()
+    monkeypatch.setattr(scheduler, 'resume_jobs', lambda: resumed.append(True))
+
+    assert (3, 1) == scheduler.refresh_all(batch_size=2, concurrency=1)
+    assert [True] == resumed
+    assert ['a/never', 'a/stale', 'a/broken', 'a/fresh'] == fetched
+
+    rows = db.session.query(Repository.url, Repository.line_count).order_by(Repository.last_refreshed).all()
+    assert [('a/broken', 1), ('a/never', 2), ('a/stale', 2), ('a/fresh', 2)] == rows
+    assert all(r.last_refreshed > datetime(2015, 1, 1) for r in Repository.query.filter(Repository.line_count == 2))
+
+    Repository.query.delete()
+    db.session.commit()
+
+
+def test_refresh_database_error(monkeypatch):
+    def fetch_and_save(repo_url, add_repo):
+        raise OperationalError('UPDATE repositories', dict(), Exception('MySQL server has gone away'))
+    monkeypatch.setattr(scheduler, 'fetch_and_save', fetch_and_save)
+
+    assert scheduler.refresh_repo('a/b') is False  # Logged, the pass goes on with the other repositories.
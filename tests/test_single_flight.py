@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from github_status.single_flight import SingleFlight
+
+
+def test_coalesced():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = list()
+
+    def func(value):
+        calls.append(value)
+        release.wait()
+        return value
+
+    results = list()
+    threads = [threading.Thread(target=lambda v=v: results.append(single_flight.do('key', func, v))) for v in 'abc']
+    threads[0].start()
+    while not calls:
+        pass  # Wait for the leader to start.
+    for t in threads[1:]:
+        t.start()
+    time.sleep(0.2)  # Let the others start waiting.
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert ['a'] == calls
+    assert ['a', 'a', 'a'] == results
+
+    assert 'd' == single_flight.do('key', func, 'd')  # Not in flight anymore.
+    assert ['a', 'd'] == calls
+
+
+def test_exception():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    errors = list()
+
+    def func():
+        release.wait()
+        raise ValueError('Bad.')
+
+    def run():
+        try:
+            single_flight.do('key', func)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for t in threads:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert 3 == len(errors)
+    with pytest.raises(ValueError):
+        single_flight.do('key', func)
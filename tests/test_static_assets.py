@@ -0,0 +1,121 @@
+import gzip
+
+from flask import current_app
+from tornado import gen, httpclient, httpserver, ioloop, testing, web
+
+from github_status.extensions import static_files
+from github_status.static_assets import build, hashed_name, load_manifest, StaticFileHandler
+
+
+def fetch(application, path, **kwargs):
+    """Starts a Tornado server and GETs the path. Keyword arguments are passed to HTTPRequest.
+
+    Returns:
+    HTTPResponse instance.
+    """
+    io_loop = ioloop.IOLoop()
+    io_loop.make_current()
+    sock, port = testing.bind_unused_port()
+    server = httpserver.HTTPServer(application, io_loop=io_loop)
+    server.add_sockets([sock])
+    client = httpclient.AsyncHTTPClient(io_loop, force_instance=True)
+
+    @gen.coroutine
+    def get():
+        response = yield gen.Task(client.fetch, 'http://127.0.0.1:{}{}'.format(port, path), **kwargs)
+        raise gen.Return(response)
+
+    try:
+        return io_loop.run_sync(get, timeout=10)
+    finally:
+        client.close()
+        server.stop()
+        ioloop.IOLoop.clear_current()
+        io_loop.close(all_fds=True)
+
+
+def make_static(tmpdir):
+    """Writes a small static folder and builds it. Returns the build folder and the manifest."""
+    source = tmpdir.mkdir('static')
+    source.join('fonts', 'icons.ttf').write('font ' * 100, ensure=True)
+    source.join('img', 'logo.png').write('png', ensure=True)
+    source.join('css', 'style.css').write(
+        "a { background: url('../img/logo.png'); }\n"
+        "@font-face { src: url(../fonts/icons.ttf?#iefix) format('truetype'); }\n"
+        "b { background: url(data:image/png;base64,AAAA); }\n"
+        "i { background: url(missing.png); }\n" * 20,
+        ensure=True
+    )
+    destination = tmpdir.join('static_build')
+    return destination, build(str(source), str(destination))
+
+
+def test_build(tmpdir):
+    destination, manifest = make_static(tmpdir)
+
+    assert manifest == load_manifest(str(destination))
+    assert None is load_manifest(str(tmpdir))
+    assert ['css/style.css', 'fonts/icons.ttf', 'img/logo.png'] == sorted(manifest)
+    assert hashed_name('img/logo.png', 'png') == manifest['img/logo.png']
+    assert 'img/logo.{}.png'.format(manifest['img/logo.png'].split('.')[1]) == manifest['img/logo.png']
+
+    css = destination.join(manifest['css/style.css']).read()
+    assert css == destination.join('css', 'style.css').read()
+    assert "url('../{}')".format(manifest['img/logo.png']) in css
+    assert 'url(../{}?#iefix)'.format(manifest['fonts/icons.ttf']) in css
+    assert 'url(data:image/png;base64,AAAA)' in css
+    assert 'url(missing.png)' in css
+
+    # Gzipped only if compressible and smaller.
+    assert css == gzip.open(str(destination.join(manifest['css/style.css'] + '.gz'))).read()
+    assert destination.join(manifest['fonts/icons.ttf'] + '.gz').check()
+    assert not destination.join(manifest['img/logo.png'] + '.gz').check()
+
+    # Rebuilding is reproducible.
+    gz = destination.join(manifest['css/style.css'] + '.gz').read_binary()
+    assert manifest == make_static(tmpdir.mkdir('again'))[1]
+    assert gz == tmpdir.join('again', 'static_build', manifest['css/style.css'] + '.gz').read_binary()
+
+
+def test_handler(tmpdir):
+    destination, manifest = make_static(tmpdir)
+    static = dict(path=str(destination), manifest=manifest)
+    application = web.Application([(r'/static/(.*)', StaticFileHandler, static)])
+    css = destination.join('css', 'style.css').read()
+
+    response = fetch(application, '/static/' + manifest['css/style.css'], use_gzip=False)
+    assert css == response.body
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' == response.headers['Vary']
+    assert 'public, max-age=31536000, immutable' == response.headers['Cache-Control']
+
+    response = fetch(application, '/static/' + manifest['css/style.css'], headers={'Accept-Encoding': 'gzip'},
+                     use_gzip=False)
+    assert 'gzip' == response.headers['Content-Encoding']
+    assert destination.join(manifest['css/style.css'] + '.gz').read_binary() == response.body
+
+    response = fetch(application, '/static/css/style.css', headers={'Accept-Encoding': 'gzip'}, use_gzip=False)
+    assert 'gzip' == response.headers['Content-Encoding']
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+    response = fetch(application, '/static/img/logo.png', headers={'Accept-Encoding': 'gzip'}, use_gzip=False)
+    assert 'png' == response.body
+    assert 'Content-Encoding' not in response.headers
+    assert 'Vary' not in response.headers
+
+
+def test_static_url(tmpdir):
+    with current_app.test_request_context():
+        assert '/static/css/style.css' == static_files.url('css/style.css')
+
+    _, manifest = make_static(tmpdir)
+    static_files.manifest = manifest
+    try:
+        with current_app.test_request_context():
+            assert '/static/' + manifest['css/style.css'] == static_files.url('css/style.css')
+            assert '/static/favicon.ico' == static_files.url('favicon.ico')
+    finally:
+        static_files.manifest = None
+
+    html = current_app.test_client().get('/').data
+    assert 'href="/static/bootstrap/css/bootstrap.min.css"' in html
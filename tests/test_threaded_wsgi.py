@@ -0,0 +1,91 @@
+import json
+import time
+
+from flask import current_app
+from tornado import gen, httpclient, httpserver, ioloop, testing, web
+
+from github_status.threaded_wsgi import ThreadedWSGIContainer
+
+
+def slow_application(environ, start_response):
+    time.sleep(0.5)  # Blocks on MySQL or GitHub.
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [environ['PATH_INFO']]
+
+
+def fetch_all(container, paths):
+    """Starts a Tornado server with the container as its fallback handler and GETs all paths concurrently.
+
+    Returns:
+    List of (status code, body) tuples in the same order as paths.
+    """
+    io_loop = ioloop.IOLoop()
+    io_loop.make_current()
+    application = web.Application([(r'.*', web.FallbackHandler, dict(fallback=container))])
+    sock, port = testing.bind_unused_port()
+    server = httpserver.HTTPServer(application, io_loop=io_loop)
+    server.add_sockets([sock])
+    client = httpclient.AsyncHTTPClient(io_loop, force_instance=True)
+
+    @gen.coroutine
+    def fetch():
+        # gen.Task passes a callback, fetch() doesn't raise on error status codes then.
+        responses = yield [gen.Task(client.fetch, 'http://127.0.0.1:{}{}'.format(port, p)) for p in paths]
+        raise gen.Return([(r.code, r.body) for r in responses])
+
+    try:
+        return io_loop.run_sync(fetch, timeout=10)
+    finally:
+        client.close()
+        server.stop()
+        ioloop.IOLoop.clear_current()
+        io_loop.close(all_fds=True)
+
+
+def test_concurrent():
+    container = ThreadedWSGIContainer(slow_application, 4, 0)
+    start = time.time()
+    actual = fetch_all(container, ['/a', '/b', '/c', '/d'])
+    elapsed = time.time() - start
+
+    assert [(200, '/a'), (200, '/b'), (200, '/c'), (200, '/d')] == actual
+    assert elapsed < 1.5  # Served one after the other would take at least 2 seconds.
+
+    stats = container.stats()
+    assert 4 == stats['requests']
+    assert 0 == stats['rejected']
+    assert 0 == stats['queue_depth']
+    assert 0 == stats['running']
+
+
+def test_admission_control():
+    container = ThreadedWSGIContainer(slow_application, 1, 1)
+    actual = fetch_all(container, ['/a', '/b', '/c'])
+
+    assert [(200, '/a'), (200, '/b'), (503, '')] == actual
+    stats = container.stats()
+    assert 2 == stats['requests']
+    assert 1 == stats['rejected']
+    assert 0.4 < stats['max_wait_seconds'] < stats['wait_seconds'] + 0.01  # Second request waited for the first one.
+
+
+def test_error():
+    def application(*_):
+        raise ValueError('Bug.')
+    container = ThreadedWSGIContainer(application, 1, 0)
+    assert [(500, '')] == fetch_all(container, ['/a'])
+    assert 1 == container.stats()['errors']
+
+
+def test_health():
+    container = ThreadedWSGIContainer(current_app._get_current_object(), 2, 5)
+    actual = fetch_all(container, ['/api/health/wsgi_threads'])
+    assert 200 == actual[0][0]
+
+    stats = json.loads(actual[0][1])
+    assert stats['enabled'] is True
+    assert 2 == stats['threads']
+    assert 5 == stats['max_queue']
+    assert 1 == stats['running']  # The health request itself.
+
+    assert dict(enabled=False) == json.loads(current_app.test_client().get('/api/health/wsgi_threads').data)
@@ -0,0 +1,53 @@
+"""Scaling checks for computations which must handle thousands of commits per repo.
+
+Work is measured by counting hashes and comparisons of author logins instead of timing, so results don't depend on the
+machine or its load.
+"""
+
+from github_status.views.api.query_github import rank_committers
+
+
+class Login(str):
+    """Commit author login counting the hashes and comparisons made on it."""
+    operations = 0
+
+    def __hash__(self):
+        Login.operations += 1
+        return str.__hash__(self)
+
+    def __eq__(self, other):
+        Login.operations += 1
+        return str.__eq__(self, other)
+
+
+def authors(count, users=500):
+    """Returns a deterministic list of commit author logins."""
+    return [Login('user{}'.format((i * 7919) % users)) for i in xrange(count)]
+
+
+def operations(func, *args):
+    """Returns the number of hashes and comparisons of Login instances made by one call."""
+    Login.operations = 0
+    func(*args)
+    return Login.operations
+
+
+def quadratic_top_three(last_fifty):
+    """The previous implementation, O(n^2)."""
+    top_three = set()
+    for author in sorted(last_fifty, key=last_fifty.count, reverse=True):
+        top_three.add(author)
+        if len(top_three) >= 3:
+            break
+    return top_three
+
+
+def test_rank_committers_linear():
+    small, large = operations(rank_committers, authors(5000), 3), operations(rank_committers, authors(50000), 3)
+    assert small <= 10 * 5000  # A few dictionary lookups per commit.
+    assert large <= 10 * 50000  # 10x the commits: linear is ~10x the work, quadratic would be ~100x.
+
+
+def test_rank_committers_faster_than_quadratic():
+    commits = authors(1000)
+    assert operations(rank_committers, commits, 3) * 10 < operations(quadratic_top_three, commits)
@@ -0,0 +1,147 @@
+import json
+import re
+
+from flask import current_app
+import httpretty
+import pytest
+
+from github_status.extensions import db
+from github_status.models.helpers import repository_version
+from github_status.models.jobs import Job
+from github_status.models.repositories import Repository
+from github_status.views.api import query_github
+
+
+def post(url, payload):
+    response = current_app.test_client().post(url, data=json.dumps(payload), content_type='application/json')
+    assert '200 OK' == response.status
+    assert 'application/x-ndjson' == response.mimetype
+    return [json.loads(l) for l in response.data.splitlines()]
+
+
+def test_bad_request():
+    with current_app.test_client() as c:
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk').status
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk', data='[]').status
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk', data='{"a": "b"}').status
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk', data='["a/b", 1]').status
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk', data='["a/b", ""]').status
+        too_many = json.dumps(['a/{}'.format(i) for i in range(current_app.config['BULK_MAX_REPOS'] + 1)])
+        assert '400 BAD REQUEST' == c.post('/api/query_github/bulk', data=too_many).status
+
+
+@pytest.mark.httpretty
+def test_bulk_add(monkeypatch):
+    Repository.query.delete()
+    db.session.add(Repository(url='bulk/Tracked', line_count=1, top_committers='', last_commit=''))
+    db.session.commit()
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *_: None)
+    monkeypatch.setattr(query_github, 'upsert', None)  # Written in bulk, not row by row.
+
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/(a|b|pending)/commits'), status=200, body=json.dumps([
+        {'author': {'login': 'Myself'}, 'commit': {'message': 'Bulk setup.py.'}},
+    ]))
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/missing/commits'), status=404, body='')
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/(a|b)/stats/contributors'), status=200,
+                           body='[{"weeks": [{"a": 7}]}]')
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/pending/stats/contributors'), status=202, body='{}')
+
+    repo_urls = ['bulk/a', 'bulk/x#', 'bulk/tracked', 'bulk/b', 'BULK/A', 'bulk/missing', 'bulk/pending']
+    lines = post('/api/query_github/bulk', repo_urls)
+
+    assert [
+        dict(repo_url='bulk/x#', success=False, error='Invalid GitHub URL, invalid character(s) found.'),
+        dict(repo_url='bulk/tracked', success=False, error='Repository already tracked, cannot add.'),
+        dict(repo_url='BULK/A', success=False, error='Duplicate repository URL.'),
+    ] == lines[:3]
+    assert sorted([
+        dict(repo_url='bulk/a', success=True, error=''),
+        dict(repo_url='bulk/b', success=True, error=''),
+        dict(repo_url='bulk/missing', success=False, error='Invalid GitHub URL specified.'),
+        dict(repo_url='bulk/pending', success=True, error=''),
+    ]) == sorted(lines[3:-1])
+    job_ids = lines[-1].pop('jobs')
+    assert dict(success=True, error='', saved=3) == lines[-1]
+    assert ['bulk/pending'] == [j.repo_url for j in Job.query.filter(Job.id.in_(job_ids))]
+
+    actual = db.session.query(Repository.url, Repository.line_count, Repository.top_committers,
+                              Repository.last_commit).order_by(Repository.url).all()
+    expected = [
+        ('bulk/Tracked', 1, '', ''),
+        ('bulk/a', 7, 'Myself', 'Bulk setup.py.'),
+        ('bulk/b', 7, 'Myself', 'Bulk setup.py.'),
+        ('bulk/pending', None, 'Myself', 'Bulk setup.py.'),
+    ]
+    assert expected == actual
+    assert 3 == Repository.query.filter(Repository.last_refreshed.isnot(None)).count()
+
+
+@pytest.mark.httpretty
+@pytest.mark.parametrize('add_repo', [True, False])
+def test_bulk_race(monkeypatch, add_repo):
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *_: None)
+    httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), status=200, body=json.dumps([
+        {'author': {'login': 'Racer'}, 'commit': {'message': 'Bulk race.'}},
+    ]))
+    httpretty.register_uri(httpretty.GET, re.compile('.*/stats/contributors'), status=200,
+                           body='[{"weeks": [{"a": 3}]}]')
+    if not add_repo:
+        db.session.add_all([Repository(url=u, top_committers='', last_commit='') for u in ('race/won', 'race/lost')])
+        db.session.commit()
+
+    def write_batch(rows, add_repo):
+        # Another request adds (or removes) a repo after bulk() verified the URLs.
+        if add_repo:
+            db.session.add(Repository(url='race/lost', top_committers='', last_commit=''))
+        else:
+            Repository.query.filter_by(url='race/lost').delete()
+        db.session.commit()
+        return real_write_batch(rows, add_repo)
+    real_write_batch, real_upsert, upserts = query_github._write_batch, query_github.upsert, list()
+    monkeypatch.setattr(query_github, '_write_batch', write_batch)
+    monkeypatch.setattr(query_github, 'upsert', lambda *a, **kw: upserts.append(a[1]['url']) or real_upsert(*a, **kw))
+
+    version = repository_version()[0]
+    lines = post('/api/query_github/bulk' if add_repo else '/api/query_github/bulk/update', ['race/won', 'race/lost'])
+    error = 'Repository already tracked, cannot add.' if add_repo else 'Repository not being tracked, cannot update.'
+    assert sorted([
+        dict(repo_url='race/lost', success=False, error=error),
+        dict(repo_url='race/won', success=True, error=''),
+    ]) == sorted(lines[:-1])
+    assert dict(success=True, error='', saved=1, jobs=list()) == lines[-1]
+    assert ['race/lost', 'race/won'] == sorted(upserts)  # Batch rolled back, then one by one.
+    assert version.split(':')[0] != repository_version()[0].split(':')[0]  # Bumped, not just max(last_refreshed).
+
+    actual = db.session.query(Repository.url, Repository.line_count, Repository.last_commit).filter(
+        Repository.url.in_(['race/won', 'race/lost'])).order_by(Repository.url).all()
+    expected = [('race/lost', None, ''), ('race/won', 3, 'Bulk race.')] if add_repo else [('race/won', 3, 'Bulk race.')]
+    assert expected == actual
+
+    Repository.query.filter(Repository.url.in_(['race/won', 'race/lost'])).delete(synchronize_session=False)
+    db.session.commit()
+
+
+@pytest.mark.httpretty
+def test_bulk_update(monkeypatch):
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *_: None)
+    monkeypatch.setattr(query_github, 'upsert', None)  # Written in bulk, not row by row.
+    httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), status=200, body=json.dumps([
+        {'author': {'login': 'You'}, 'commit': {'message': 'Bulk update.'}},
+    ]))
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/a/stats/contributors'), status=200,
+                           body='[{"weeks": [{"a": 9}]}]')
+    httpretty.register_uri(httpretty.GET, re.compile('.*/bulk/b/stats/contributors'), status=202, body='{}')
+
+    lines = post('/api/query_github/bulk/update', ['bulk/a', 'bulk/b', 'bulk/new'])
+    assert dict(repo_url='bulk/new', success=False, error='Repository not being tracked, cannot update.') == lines[0]
+    assert [True, True] == [l['success'] for l in lines[1:-1]]
+    assert 2 == lines[-1]['saved']
+    assert 1 == len(lines[-1]['jobs'])
+
+    actual = db.session.query(Repository.url, Repository.line_count, Repository.top_committers,
+                              Repository.last_commit).filter(Repository.url.in_(['bulk/a', 'bulk/b'])).all()
+    assert [('bulk/a', 9, 'You', 'Bulk update.'), ('bulk/b', 7, 'You', 'Bulk update.')] == sorted(actual)
+    assert [2, 2] == [w for w, in db.session.query(Repository.writes).filter(Repository.url.in_(['bulk/a', 'bulk/b']))]
+
+    Repository.query.delete()
+    db.session.commit()
@@ -1,11 +1,16 @@
 import json
 import os
 import re
+import time
 
+from flask import current_app
 import httpretty
 import pytest
+from requests import ConnectionError
 
-from github_status.views.api.query_github import APIError, get_committers_details, get_line_count
+from github_status.extensions import github
+from github_status.views.api.query_github import (APIError, fold_line_count, get_committers_details, get_line_count,
+                                                  get_line_stats, iter_json_array, rank_committers, StatsPendingError)
 
 
 @pytest.mark.httpretty
@@ -42,10 +47,10 @@ def test_get_committers_details_partial():
         httpretty.Response(body=fourth_payload, status=200),
     ])
 
-    assert (set(), '') == get_committers_details('user/project')
-    assert (set(), 'New setup.py.') == get_committers_details('user/project')
-    assert ({'Myself', }, '') == get_committers_details('user/project')
-    assert ({'b', 'c', 'd'}, '') == get_committers_details('user/project')
+    assert ([], '') == get_committers_details('user/project')
+    assert ([], 'New setup.py.') == get_committers_details('user/project')
+    assert (['Myself'], '') == get_committers_details('user/project')
+    assert (['c', 'b', 'd'], '') == get_committers_details('user/project')
 
 
 @pytest.mark.httpretty
@@ -54,7 +59,7 @@ def test_get_committers_details_full():
         payload = f.read(110000)
     httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), body=payload)
 
-    expected = {'Robpol86', }, 'New setup.py, codecov.io, shields.io.\n\nNormalizing across all of my projects.'
+    expected = ['Robpol86'], 'New setup.py, codecov.io, shields.io.\n\nNormalizing across all of my projects.'
     assert expected == get_committers_details('user/project')
 
 
@@ -82,27 +87,18 @@ def test_get_line_count_errors():
 @pytest.mark.httpretty
 def test_get_line_count_202():
     httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), responses=[
-        httpretty.Response(body='{}', status=202),
-        httpretty.Response(body='{}', status=202),
         httpretty.Response(body='{}', status=202),  # GitHub still generating data, try again later.
-
-        httpretty.Response(body='{}', status=202),
-        httpretty.Response(body='{}', status=202),
         httpretty.Response(body='[{"weeks": [{"a": 1}]}]', status=200),
-
-        httpretty.Response(body='{}', status=202),
-        httpretty.Response(body='[{"weeks": [{"a": 2}]}]', status=200),
-        httpretty.Response(body='{}', status=202),  # Should never reach.
     ])
 
-    with pytest.raises(APIError) as e:
+    start = time.time()
+    with pytest.raises(StatsPendingError) as e:
         get_line_count('user/project')
     assert 'GitHub still generating data, try again later.' == e.value.message
+    assert time.time() - start < 0.5  # Never sleeps.
 
     assert 1 == get_line_count('user/project')
 
-    assert 2 == get_line_count('user/project')
-
 
 @pytest.mark.httpretty
 def test_get_line_count_full():
@@ -111,3 +107,129 @@ def test_get_line_count_full():
     httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), body=payload)
 
     assert 654 == get_line_count('user/project')
+
+
+def test_fold_line_count():
+    week = 7 * 24 * 60 * 60
+    contributors = [
+        dict(author=dict(login='a'), weeks=[dict(w=0, a=10, d=1), dict(w=week, a=5), dict(w=2 * week, a=1)]),
+        dict(author=None, weeks=[dict(w=0, a=3), dict(w=week, a=0), dict(w=2 * week, a=0)]),
+    ]
+    line_count, watermark, totals = fold_line_count(contributors, None, dict())
+    assert (18, week, dict(a=14)) == (line_count, watermark, totals)
+
+    # Only newer weeks of known contributors are summed up, their older weeks come from the totals.
+    contributors[0]['weeks'][0]['a'] = 1000
+    contributors[0]['weeks'][2]['a'] = 2
+    contributors[0]['weeks'].append(dict(w=3 * week, a=4))
+    contributors.append(dict(author=dict(login='b'), weeks=[dict(w=0, a=0), dict(w=week, a=0), dict(w=2 * week, a=7),
+                                                            dict(w=3 * week, a=0)]))
+    line_count, watermark, totals = fold_line_count(contributors, watermark, totals)
+    assert (30, 2 * week, dict(a=16, b=7)) == (line_count, watermark, totals)
+
+    # GitHub's data went back in time, start from scratch.
+    line_count, watermark, totals = fold_line_count(contributors[:1], 10 * week, dict(a=-100))
+    assert (1010, 2 * week, dict(a=1006)) == (line_count, watermark, totals)
+
+
+@pytest.mark.httpretty
+def test_get_line_stats_incremental():
+    with open(os.path.join(os.path.dirname(__file__), 'example_contributors.json')) as f:
+        payload = f.read(110000)
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), body=payload)
+
+    stats = get_line_stats('user/incremental', None)
+    assert 654 == stats['line_count']
+    assert dict(line_count=654, line_count_week=stats['line_count_week'],
+                line_count_totals=stats['line_count_totals']) == get_line_stats('user/incremental', stats)
+
+
+def test_unreachable(monkeypatch):
+    def get(*_, **__):
+        raise ConnectionError
+    monkeypatch.setattr(github, 'get', get)
+
+    with pytest.raises(APIError) as e:
+        get_committers_details('user/project')
+    assert 'Unable to reach GitHub, try again later.' == e.value.message
+
+    with pytest.raises(APIError) as e:
+        get_line_count('user/project')
+    assert 'Unable to reach GitHub, try again later.' == e.value.message
+
+
+@pytest.mark.httpretty
+def test_conditional_requests():
+    headers = dict(etag='"abc"', last_modified='Tue, 01 Jan 2030 00:00:00 GMT')
+    httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), responses=[
+        httpretty.Response(body=json.dumps([dict(author=dict(login='a'), commit=dict(message='A'))]), **headers),
+        httpretty.Response(body='', status=304),
+        httpretty.Response(body=json.dumps([dict(author=dict(login='b'), commit=dict(message='B'))]), etag='"def"'),
+    ])
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), responses=[
+        httpretty.Response(body='[{"weeks": [{"a": 5}]}]', **headers),
+        httpretty.Response(body='', status=304),
+    ])
+
+    assert (['a'], 'A') == get_committers_details('user/cached')
+    assert 'If-None-Match' not in httpretty.last_request().headers
+    assert (['a'], 'A') == get_committers_details('user/cached')
+    assert '"abc"' == httpretty.last_request().headers['If-None-Match']
+    assert 'Tue, 01 Jan 2030 00:00:00 GMT' == httpretty.last_request().headers['If-Modified-Since']
+    assert (['b'], 'B') == get_committers_details('user/cached')
+    cached = github.cache.get('https://api.github.com/repos/user/cached/commits?per_page=50&page=1')['value']
+    assert (['b'], 'B', 1) == cached
+
+    assert 5 == get_line_count('user/cached')
+    assert 5 == get_line_count('user/cached')
+    assert '"abc"' == httpretty.last_request().headers['If-None-Match']
+
+
+def test_rank_committers():
+    assert [] == rank_committers([], 3)
+    assert [] == rank_committers(['', ''], 3)
+    assert ['a'] == rank_committers(['', 'a', ''], 3)
+    assert ['c', 'b', 'd'] == rank_committers(list('abbcccdd'), 3)
+    assert ['c', 'd', 'b'] == rank_committers(list('addcccbb'), 3)  # Ties broken by most recent commit (first).
+    assert ['c', 'd', 'b', 'a'] == rank_committers(list('addcccbb'), 10)
+    assert ['c'] == rank_committers(list('addcccbb'), 1)
+
+
+def test_iter_json_array():
+    with open(os.path.join(os.path.dirname(__file__), 'example_commits.json')) as f:
+        payload = f.read(110000)
+    expected = json.loads(payload)
+    for size in (97, 4096, len(payload)):
+        chunks = (payload[i:i + size] for i in range(0, len(payload), size))
+        assert expected == list(iter_json_array(chunks))
+
+    assert [] == list(iter_json_array([' [', ' ] ']))
+    assert [] == list(iter_json_array(['{', '}']))
+    assert [[1], {'a': [2]}] == list(iter_json_array(['[[1]', ' ,{"a"', ': [2]}', ']']))
+    assert [{'a': u'[,]'}, []] == list(iter_json_array(list('[{"a": "[,]"}, []]')))
+
+    for invalid in ('', '[', '[{}', '[{} {}]', '[{},', '{"a": 1}', '[{"a": }]'):
+        with pytest.raises(ValueError):
+            list(iter_json_array([invalid]))
+
+
+@pytest.mark.httpretty
+def test_get_committers_details_pagination(monkeypatch):
+    monkeypatch.setitem(current_app.config, 'GITHUB_COMMITS_WINDOW', 250)
+    url = 'https://api.github.com/repos/user/paginated/commits?per_page=100&page={}'
+    link = '<{}>; rel="next", <{}>; rel="last"'.format(url.format(2), url.format(5))
+    login = lambda l: dict(author=dict(login=l))
+    pages = [
+        [dict(author=dict(login='a'), commit=dict(message='Latest.'))] * 100,
+        [login('b')] * 100,
+        [login('c')] * 10 + [login('d')] * 40 + [login('e')] * 50,
+    ]
+    for page, payload in enumerate(pages, 1):
+        headers = dict(Link=link) if page == 1 else dict()
+        httpretty.register_uri(httpretty.GET, re.compile(r'.*/paginated/commits\?per_page=100&page={}$'.format(page)),
+                               body=json.dumps(payload), forcing_headers=headers, match_querystring=True)
+    httpretty.register_uri(httpretty.GET, re.compile(r'.*/paginated/commits\?per_page=100&page=[45]$'), status=500,
+                           body='', match_querystring=True)  # Outside the window, never requested.
+
+    assert (['a', 'b', 'd'], 'Latest.') == get_committers_details('user/paginated')  # 'e' is outside the window.
+    assert ['1', '2', '3'] == sorted(r.querystring['page'][0] for r in httpretty.HTTPretty.latest_requests)
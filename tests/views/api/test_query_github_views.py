@@ -1,12 +1,17 @@
+from datetime import datetime, timedelta
 import json
 import re
+import time
 
 from flask import current_app
 import httpretty
 import pytest
 
 from github_status.extensions import db
+from github_status.models.jobs import Job
 from github_status.models.repositories import Repository
+from github_status.rate_limit import RateLimiter
+from github_status.views.api import query_github
 
 
 @pytest.mark.httpretty
@@ -55,6 +60,7 @@ def test_add_data():
     actual = db.session.query(Repository.url, Repository.line_count, Repository.top_committers,
                               Repository.last_commit).all()
     assert expected == actual
+    assert 'New setup.py.' == db.session.query(Repository.last_commit_summary).scalar()
 
 
 @pytest.mark.httpretty
@@ -89,3 +95,209 @@ def test_collisions_missing():
         assert 'Repository not being tracked, cannot update.' == resp['error']
 
     assert 1 == Repository.query.count()
+
+
+def test_collisions_race(monkeypatch):
+    """Another process adds/removes the repo after query() checked."""
+    monkeypatch.setattr(query_github, 'exists', lambda _, u: u == '1/3')
+    monkeypatch.setattr(query_github, 'fetch_metadata', lambda u: dict(
+        url=u, line_count=5, top_committers='Race', last_commit='Race setup.py.'))
+
+    with current_app.test_client() as c:
+        resp = json.loads(c.post('/api/query_github', data=dict(repo_url='1/2')).data)
+        assert resp['success'] is False
+        assert 'Repository already tracked, cannot add.' == resp['error']
+
+        resp = json.loads(c.post('/api/query_github/update', data=dict(repo_url='1/3')).data)
+        assert resp['success'] is False
+        assert 'Repository not being tracked, cannot update.' == resp['error']
+
+    assert [('1/2', 'Myself You2')] == db.session.query(Repository.url, Repository.top_committers).all()
+
+
+@pytest.mark.httpretty
+def test_deadline(monkeypatch):
+    httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), status=200, body=json.dumps([
+        {'author': {'login': 'Myself'}, 'commit': {'message': 'Newest setup.py.'}},
+    ]))
+    monkeypatch.setattr(query_github, 'get_line_stats', lambda *_: time.sleep(1) or dict(line_count=3))
+    current_app.config['GITHUB_QUERY_TIMEOUT'] = 0.5
+
+    try:
+        resp = json.loads(current_app.test_client().post('/api/query_github/update', data=dict(repo_url='1/2')).data)
+    finally:
+        current_app.config['GITHUB_QUERY_TIMEOUT'] = 10
+    assert resp['success'] is False
+    assert 'GitHub took too long to respond, try again later.' == resp['error']
+
+    expected = [('1/2', 2, 'Myself You2', 'Newer setup.py.')]
+    actual = db.session.query(Repository.url, Repository.line_count, Repository.top_committers,
+                              Repository.last_commit).all()
+    assert expected == actual
+
+
+@pytest.mark.httpretty
+def test_stats_job(monkeypatch):
+    httpretty.register_uri(httpretty.GET, re.compile('.*/commits'), status=200, body=json.dumps([
+        {'author': {'login': 'Myself'}, 'commit': {'message': 'Job setup.py.'}},
+    ]))
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), responses=[
+        httpretty.Response(body='{}', status=202),
+        httpretty.Response(body='{}', status=202),
+        httpretty.Response(body='[{"weeks": [{"a": 4}]}]', status=200),
+    ])
+    scheduled = list()
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *a: scheduled.append(a))
+
+    start = time.time()
+    resp = json.loads(current_app.test_client().post('/api/query_github', data=dict(repo_url='1/job')).data)
+    assert time.time() - start < 0.5  # Never sleeps.
+    assert resp['success'] is True
+    job_id = resp['job']
+    assert [(1, query_github.finish_job, job_id)] == scheduled
+    assert [(None, 'Myself', 'Job setup.py.')] == db.session.query(
+        Repository.line_count, Repository.top_committers, Repository.last_commit).filter_by(url='1/job').all()
+
+    resp = json.loads(current_app.test_client().get('/api/query_github/jobs/{}'.format(job_id)).data)
+    assert dict(success=True, error='', status='pending', repo_url='1/job', attempts=0) == resp
+    assert '200 OK' == current_app.test_client().get('/details/1/job').status
+
+    # First retry, still generating.
+    query_github.finish_job(job_id)
+    assert (2, query_github.finish_job, job_id) == scheduled[-1]
+    assert ('pending', 1) == db.session.query(Job.status, Job.attempts).filter_by(id=job_id).one()
+
+    # Second retry, done.
+    query_github.finish_job(job_id)
+    assert 2 == len(scheduled)
+    resp = json.loads(current_app.test_client().get('/api/query_github/jobs/{}'.format(job_id)).data)
+    assert dict(success=True, error='', status='done', repo_url='1/job', attempts=2) == resp
+    assert (4, 2) == db.session.query(Repository.line_count, Repository.writes).filter_by(url='1/job').one()
+
+    assert '404 NOT FOUND' == current_app.test_client().get('/api/query_github/jobs/unknown').status
+
+    Repository.query.filter_by(url='1/job').delete()
+    db.session.commit()
+
+
+@pytest.mark.httpretty
+def test_stats_job_failed(monkeypatch):
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), body='{}', status=202)
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *_: None)
+    job_id = query_github.start_job('1/2')
+
+    for _ in range(current_app.config['GITHUB_STATS_RETRIES'] + 1):
+        query_github.finish_job(job_id)
+
+    resp = json.loads(current_app.test_client().get('/api/query_github/jobs/{}'.format(job_id)).data)
+    expected = dict(success=False, error='GitHub still generating data, try again later.', status='failed',
+                    repo_url='1/2', attempts=current_app.config['GITHUB_STATS_RETRIES'] + 1)
+    assert expected == resp
+
+
+def test_stats_job_unexpected_error(monkeypatch):
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *_: None)
+    job_id = query_github.start_job('1/2')
+
+    def get_line_stats(*_):
+        db.session.add(Job(id=job_id, repo_url='1/2'))  # Duplicate primary key, fails on commit.
+        return dict(line_count=1)
+    monkeypatch.setattr(query_github, 'get_line_stats', get_line_stats)
+    query_github.finish_job(job_id)
+
+    resp = json.loads(current_app.test_client().get('/api/query_github/jobs/{}'.format(job_id)).data)
+    expected = dict(success=False, error='Unexpected error, try again later.', status='failed', repo_url='1/2',
+                    attempts=1)
+    assert expected == resp
+
+    query_github.finish_job('unknown')  # Deleted job, nothing to do.
+
+
+def test_resume_jobs(monkeypatch):
+    scheduled = list()
+    monkeypatch.setattr(query_github.workers, 'submit_later', lambda *a: scheduled.append(a))
+    Job.query.delete()
+    now = datetime.utcnow()
+    jobs = dict(
+        orphaned=Job(repo_url='r/orphaned', updated=now - timedelta(seconds=100)),  # Due after 1 second.
+        retrying=Job(repo_url='r/retrying', attempts=3, updated=now - timedelta(seconds=100)),  # Due after 8 seconds.
+        waiting=Job(repo_url='r/waiting', attempts=6, updated=now - timedelta(seconds=100)),  # Due after 64 seconds.
+        recent=Job(repo_url='r/recent', updated=now),
+        done=Job(repo_url='r/done', status='done', updated=now - timedelta(days=1)),
+    )
+    db.session.add_all(jobs.values())
+    db.session.commit()
+
+    resumed = query_github.resume_jobs()
+    assert sorted([jobs['orphaned'].id, jobs['retrying'].id]) == sorted(resumed)
+    assert sorted((0, query_github.finish_job, i) for i in resumed) == sorted(scheduled)
+    assert [] == query_github.resume_jobs()  # Claimed, not resumed twice.
+
+    # Finished by the process which resumed it, the original timer doesn't run it again.
+    Job.query.filter_by(id=jobs['orphaned'].id).update(dict(status='done'))
+    db.session.commit()
+    monkeypatch.setattr(query_github, '_finish_job', None)
+    query_github.finish_job(jobs['orphaned'].id)
+
+    Job.query.delete()
+    db.session.commit()
+
+
+@pytest.mark.httpretty
+def test_rate_limit(monkeypatch):
+    monkeypatch.setattr(query_github.github, 'limiter', RateLimiter(['a', 'b'], 0))
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), status=200, body='[{"weeks": [{"a": 1}]}]',
+                           forcing_headers={'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '4999',
+                                            'X-RateLimit-Reset': '4102444800'})
+    query_github.get_line_count('1/2')
+    assert 'token a' == httpretty.last_request().headers['Authorization']
+
+    resp = json.loads(current_app.test_client().get('/api/query_github/rate_limit').data)
+    expected = dict(success=True, error='', remaining=4999, tokens=[
+        dict(limit=5000, remaining=4999, reset=4102444800),
+        dict(limit=None, remaining=None, reset=None),
+    ])
+    assert expected == resp
+
+    # Token b's quota used up elsewhere, switches back to token a.
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), responses=[
+        httpretty.Response(body='', status=403, forcing_headers={'X-RateLimit-Remaining': '0',
+                                                                 'X-RateLimit-Reset': '4102444800'}),
+        httpretty.Response(body='[{"weeks": [{"a": 2}]}]', status=200),
+    ])
+    assert 2 == query_github.get_line_count('1/2')
+    assert 'token a' == httpretty.last_request().headers['Authorization']
+
+    # Both out of quota.
+    httpretty.register_uri(httpretty.GET, re.compile('.*/contributors'), status=403, body='', forcing_headers={
+        'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '4102444800'})
+    with pytest.raises(query_github.APIError) as e:
+        query_github.get_line_count('1/2')
+    assert 'GitHub API rate limit exceeded, try again later.' == e.value.message
+
+
+@pytest.mark.httpretty
+def test_db_lock_reuse(monkeypatch):
+    fetched = list()
+    monkeypatch.setattr(query_github, 'fetch_metadata', lambda u: fetched.append(u) or dict(
+        url=u, line_count=5, top_committers='Locked', last_commit='Locked setup.py.'))
+    monkeypatch.setitem(current_app.config, 'SINGLE_FLIGHT_DB_LOCK', True)
+
+    # Refreshed by another process while waiting for the lock.
+    db.session.query(Repository).filter_by(url='1/2').update(dict(last_refreshed=datetime(2100, 1, 1)))
+    db.session.commit()
+    assert query_github.fetch_and_save('1/2', add_repo=False) is None
+    assert [] == fetched
+
+    # Added by another process while waiting for the lock, same error as without the lock.
+    with pytest.raises(query_github.APIError) as e:
+        query_github.fetch_and_save('1/2', add_repo=True)
+    assert 'Repository already tracked, cannot add.' == e.value.message
+    assert [] == fetched
+
+    # Stale.
+    db.session.query(Repository).filter_by(url='1/2').update(dict(last_refreshed=datetime(2000, 1, 1)))
+    db.session.commit()
+    assert query_github.fetch_and_save('1/2', add_repo=False) is None
+    assert ['1/2'] == fetched
+    assert 5 == db.session.query(Repository.line_count).filter_by(url='1/2').scalar()
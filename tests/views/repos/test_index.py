@@ -0,0 +1,153 @@
+from datetime import datetime
+import json
+
+from flask import current_app
+import pytest
+
+from github_status.cache import MemoryCache
+from github_status.extensions import db, page_cache
+from github_status.models.repositories import Repository
+
+
+def get(query_string):
+    response = current_app.test_client().get('/data', query_string=query_string)
+    assert '200 OK' == response.status
+    return json.loads(response.data)
+
+
+@pytest.fixture
+def repos():
+    Repository.query.delete()
+    for i in range(5):
+        db.session.add(Repository(url='user{}/project'.format(i), line_count=i, top_committers='c{} d'.format(4 - i),
+                                  last_commit='Commit 100%_{}.\n\nDetails.'.format(i),
+                                  last_commit_summary='Commit 100%_{}.'.format(i)))
+    db.session.commit()
+
+
+def test_empty():
+    Repository.query.delete()
+    db.session.commit()
+    expected = dict(draw=1, recordsTotal=0, recordsFiltered=0, data=list())
+    assert expected == get({'draw': '1', 'start': '0', 'length': '10'})
+
+
+def test_paging(repos):
+    actual = get({'draw': '2', 'start': '1', 'length': '2'})
+    assert 2 == actual['draw']
+    assert 5 == actual['recordsTotal']
+    assert 5 == actual['recordsFiltered']
+    expected = [
+        dict(url='user1/project', details_url='/details/user1/project', top_committers=['c3', 'd'],
+             last_commit='Commit 100%_1.'),
+        dict(url='user2/project', details_url='/details/user2/project', top_committers=['c2', 'd'],
+             last_commit='Commit 100%_2.'),
+    ]
+    assert expected == actual['data']
+
+    current_app.config['REPOS_INDEX_MAX_PAGE_LENGTH'] = 3
+    try:
+        assert 3 == len(get({'start': '0', 'length': '-1'})['data'])
+        assert 3 == len(get({'start': '0', 'length': '50'})['data'])
+    finally:
+        current_app.config['REPOS_INDEX_MAX_PAGE_LENGTH'] = 100
+
+
+def test_ordering(repos):
+    actual = get({'order[0][column]': '1', 'order[0][dir]': 'asc'})
+    assert ['user4/project', 'user3/project', 'user2/project', 'user1/project', 'user0/project'] == [
+        r['url'] for r in actual['data']]
+
+    actual = get({'order[0][column]': '0', 'order[0][dir]': 'desc', 'start': '3'})
+    assert ['user1/project', 'user0/project'] == [r['url'] for r in actual['data']]
+
+
+def test_search(repos):
+    actual = get({'search[value]': 'USER3'})
+    assert (5, 1) == (actual['recordsTotal'], actual['recordsFiltered'])
+    assert ['user3/project'] == [r['url'] for r in actual['data']]
+
+    actual = get({'search[value]': 'c1 d'})
+    assert ['user3/project'] == [r['url'] for r in actual['data']]
+
+    # Wildcards are searched for literally.
+    assert 5 == get({'search[value]': '100%_'})['recordsFiltered']
+    assert 0 == get({'search[value]': '1_0'})['recordsFiltered']
+    assert 0 == get({'search[value]': 'Details'})['recordsFiltered']
+
+
+def test_bad_request():
+    with current_app.test_client() as c:
+        assert '400 BAD REQUEST' == c.get('/data?start=a').status
+        assert '400 BAD REQUEST' == c.get('/data?order[0][column]=3').status
+        assert '400 BAD REQUEST' == c.get('/data?order[0][column]=-1').status
+
+
+def test_page_cache(repos, monkeypatch):
+    monkeypatch.setattr(page_cache, 'local', MemoryCache(10))
+    monkeypatch.setattr(page_cache, 'generations', MemoryCache(10))
+
+    assert ['user0/project'] == [r['url'] for r in get({'draw': '1', 'length': '1'})['data']]
+    with current_app.test_client() as c:
+        assert 'Commit 100%_1.' in c.get('/details/user1/project').data
+    Repository.query.filter_by(url='user0/project').delete()
+    Repository.query.filter_by(url='user1/project').update(dict(last_commit='Changed.'))
+    db.session.commit()
+
+    # Cached, draw is still echoed back.
+    assert dict(draw=2, url='user0/project') == (lambda r: dict(draw=r['draw'], url=r['data'][0]['url']))(
+        get({'draw': '2', 'length': '1'}))
+    with current_app.test_client() as c:
+        assert 'Commit 100%_1.' in c.get('/details/user1/project').data
+        assert '404 NOT FOUND' == c.get('/details/user9/project').status
+
+    page_cache.invalidate('User1/Project')
+    assert ['user1/project'] == [r['url'] for r in get({'draw': '3', 'length': '1'})['data']]
+    with current_app.test_client() as c:
+        assert 'Changed.' in c.get('/details/user1/project').data
+
+
+def test_page_cache_lagging_replica(repos, monkeypatch):
+    monkeypatch.setattr(page_cache, 'local', MemoryCache(10))
+    monkeypatch.setattr(page_cache, 'generations', MemoryCache(10))
+
+    # Invalidated by a write to the primary, then rendered from a replica which doesn't have the write yet.
+    page_cache.invalidate('User2/Project')
+    assert 'user1/project' in [r['url'] for r in get({'draw': '1'})['data']]
+    with current_app.test_client() as c:
+        assert 'Commit 100%_2.' in c.get('/details/user2/project').data
+
+    # Replica caught up, the lagging responses aren't served.
+    Repository.query.filter_by(url='user1/project').delete()
+    Repository.query.filter_by(url='user2/project').update(dict(last_commit='Changed.', writes=1,
+                                                                last_refreshed=datetime(2015, 1, 1)))
+    db.session.commit()
+    assert 'user1/project' not in [r['url'] for r in get({'draw': '2'})['data']]
+    with current_app.test_client() as c:
+        assert 'Changed.' in c.get('/details/user2/project').data
+
+
+def test_conditional(repos):
+    with current_app.test_client() as c:
+        response = c.get('/data?draw=1')
+        etag = response.headers['ETag']
+        assert 'no-cache' == response.headers['Cache-Control']
+        assert 'Last-Modified' not in response.headers  # No last_refreshed values.
+        assert '304 NOT MODIFIED' == c.get('/data?draw=1', headers={'If-None-Match': etag}).status
+        assert '200 OK' == c.get('/', headers={'If-None-Match': etag}).status  # Different view, different ETag.
+
+        # Writes change the version.
+        Repository.query.filter_by(url='user1/project').update(dict(last_refreshed=datetime(2015, 1, 1)))
+        db.session.commit()
+        response = c.get('/data?draw=1', headers={'If-None-Match': etag})
+        assert '200 OK' == response.status
+        assert 'Thu, 01 Jan 2015 00:00:00 GMT' == response.headers['Last-Modified']
+        response = c.get('/details/user1/project', headers={'If-Modified-Since': 'Thu, 01 Jan 2015 00:00:00 GMT'})
+        assert '304 NOT MODIFIED' == response.status
+        assert '' == response.data
+        assert response.headers['ETag']
+
+        # Missing rows have no validators.
+        response = c.get('/details/user9/project', headers={'If-None-Match': '*'})
+        assert '404 NOT FOUND' == response.status
+        assert 'ETag' not in response.headers